@@ -0,0 +1,247 @@
+# run_benchmarks.py
+"""
+Time loading, processing and rendering of every report chart.
+
+A synthetic workbook (see synthetic.py) is generated at the requested size,
+or an existing workbook is used, and every chart is run `--repeat` times:
+
+- load:    a fresh workbook session reading the chart's sheet (no caches)
+- process: time spent in core processors, time indexing and derived metrics
+- render:  the rest of the plot function, including writing the images
+
+Charts are loaded and drawn through the runner in a RunContext, like a
+report run, so `--range` and `--memory-budget` are benchmarked as well. In
+bounded-memory mode, sheets of 'chunked' charts are read while the chart
+is drawn and their reading counts towards process and render.
+
+Each module's `generate_all` is timed end to end as well. Results are
+written as JSON so runs of different versions can be compared offline:
+
+    python benchmarks/run_benchmarks.py --days 730 --repeat 3 --output bench.json
+    python benchmarks/run_benchmarks.py --days 730 --range kpi.daily=730 --memory-budget 64
+"""
+import argparse
+import contextlib
+import functools
+import io
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / 'src'))
+
+import matplotlib
+matplotlib.use('Agg')
+import pandas as pd
+
+from seiya2_viz.core import context, loader, metrics, processors, runner, sources, timeindex
+from seiya2_viz.modules import MODULE_NAMES
+from seiya2_viz.utils import plotting
+
+import synthetic
+from main import bounded_int, chart_range
+
+# Module-level functions counted as "process" time
+PROCESS_MODULES = (processors, timeindex, metrics)
+
+
+class ProcessTimer:
+    """Accumulates the time spent in the public functions of PROCESS_MODULES."""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self._depth = 0
+        self._originals = []
+
+    def _wrap(self, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            # Only the outermost call counts, processors call each other
+            self._depth += 1
+            start_time = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.seconds += time.perf_counter() - start_time
+        return timed
+
+    def __enter__(self):
+        for module in PROCESS_MODULES:
+            for name, value in vars(module).items():
+                if callable(value) and not name.startswith('_') and getattr(value, '__module__', None) == module.__name__ \
+                        and not isinstance(value, type):
+                    self._originals.append((module, name, value))
+                    setattr(module, name, self._wrap(value))
+        return self
+
+    def __exit__(self, *exc):
+        for module, name, value in self._originals:
+            setattr(module, name, value)
+        self._originals.clear()
+
+
+def _summary(samples) -> dict:
+    return {'min': min(samples), 'median': statistics.median(samples), 'runs': samples}
+
+
+def _quiet(verbose):
+    return contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+
+
+@contextlib.contextmanager
+def _cold_session():
+    """A new session on the run's workbook, bypassing the disk cache, made the active one."""
+    with loader.WorkbookSession(use_cache=False) as session:
+        loader.use_session(session)
+        try:
+            yield session
+        finally:
+            loader.use_session(None)
+
+
+def bench_chart(chart_id: str, repeat: int, verbose=False) -> dict:
+    """Time load, process and render of one chart of the active run `repeat` times."""
+    chart = runner.resolve_chart(chart_id)
+    timings = {'load': [], 'process': [], 'render': [], 'total': []}
+    rows = None
+    for _ in range(repeat):
+        with _quiet(verbose), _cold_session():
+            start_time = time.perf_counter()
+            data = runner.load_chart(chart_id)
+            load_seconds = time.perf_counter() - start_time
+            if data is None:
+                raise RuntimeError(f"Sheet '{chart['sheet']}' of {chart_id} could not be loaded")
+            # Chunked sheets are not read yet
+            rows = len(data) if isinstance(data, pd.DataFrame) else None
+
+            with ProcessTimer() as timer:
+                start_time = time.perf_counter()
+                runner.draw_chart(chart_id, data)
+                plotting.flush_outputs()
+                plot_seconds = time.perf_counter() - start_time
+            plotting.collect_saved_paths()
+
+        timings['load'].append(load_seconds)
+        timings['process'].append(timer.seconds)
+        timings['render'].append(plot_seconds - timer.seconds)
+        timings['total'].append(load_seconds + plot_seconds)
+    return {'chart': chart_id, 'sheet': chart['sheet'], 'rows': rows, 'range': chart.get('range'),
+            **{stage: _summary(samples) for stage, samples in timings.items()}}
+
+
+def bench_module(module_name: str, repeat: int, verbose=False) -> dict:
+    """Time a module's generate_all() on the active run end to end `repeat` times."""
+    module = runner.get_module(module_name)
+    samples = []
+    for _ in range(repeat):
+        with _quiet(verbose), _cold_session():
+            start_time = time.perf_counter()
+            module.generate_all()
+            plotting.flush_outputs()
+            samples.append(time.perf_counter() - start_time)
+        plotting.collect_saved_paths()
+    return {'module': module_name, 'generate_all': _summary(samples)}
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Seiya2 weekly report charts.')
+    parser.add_argument('--workbook', type=Path, default=None,
+                        help='Benchmark an existing workbook (or other source) instead of generating a synthetic one.')
+    parser.add_argument('--format', choices=list(sources.SOURCE_TYPES), default='excel',
+                        help='Source format of the synthetic workbook (default: excel).')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per chart (default: 3).')
+    parser.add_argument('--charts', nargs='*', default=None,
+                        help="Chart ids to benchmark, e.g. 'kpi.channel' (default: all).")
+    parser.add_argument('--output', type=Path, default=None,
+                        help='JSON file for the results (default: benchmarks/results/<timestamp>.json).')
+    parser.add_argument('--range', nargs='+', type=chart_range, default=[], metavar='CHART=N',
+                        help="Show the latest N periods in these charts, as in src/main.py.")
+    parser.add_argument('--memory-budget', type=bounded_int(1), default=None, metavar='MB',
+                        help="Read the sheets of 'chunked' charts in chunks that fit this many MB.")
+    parser.add_argument('--verbose', action='store_true', help="Show the charts' own output.")
+    synthetic.add_size_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = {name: getattr(args, name) for name in synthetic.DEFAULT_SIZES}
+    chart_ids = args.charts or runner.list_charts()
+    module_names = [name for name in MODULE_NAMES if any(c.split('.', 1)[0] == name for c in chart_ids)]
+
+    with tempfile.TemporaryDirectory(prefix='seiya2-bench-') as tmp:
+        tmp = Path(tmp)
+        workbook = args.workbook
+        if workbook is None:
+            print(f"Generating synthetic {args.format} workbook {sizes} ...")
+            name = {'excel': 'synthetic.xlsx', 'sqlite': 'synthetic.sqlite'}.get(args.format, 'synthetic')
+            workbook = synthetic.write_workbook(tmp / name, args.seed, args.format, **sizes)
+
+        # Keep the real reports untouched; sessions bypass the disk cache to measure cold loads
+        settings = {'CHART_RANGES': dict(args.range)}
+        if args.memory_budget is not None:
+            settings['MEMORY_BUDGET_MB'] = args.memory_budget
+        run = context.RunContext(workbook, tmp / 'reports', **settings)
+        with _quiet(args.verbose):
+            plotting.setup_matplotlib_style()
+
+        charts = []
+        modules = []
+        with context.use(run):
+            for chart_id in chart_ids:
+                result = bench_chart(chart_id, args.repeat, args.verbose)
+                charts.append(result)
+                print(f"  {chart_id:<28} load {result['load']['median']:6.3f}s  "
+                      f"process {result['process']['median']:6.3f}s  render {result['render']['median']:6.3f}s")
+            for module_name in module_names:
+                result = bench_module(module_name, args.repeat, args.verbose)
+                modules.append(result)
+                print(f"  {module_name + '.generate_all':<28} total {result['generate_all']['median']:6.3f}s")
+
+        report = {
+            'meta': {
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'commit': _git_commit(),
+                'python': platform.python_version(),
+                'pandas': pd.__version__,
+                'matplotlib': matplotlib.__version__,
+                'platform': platform.platform(),
+                'workbook': str(args.workbook) if args.workbook else 'synthetic',
+                'workbook_format': sources.open_source(workbook).kind,
+                'workbook_bytes': sum(path.stat().st_size for path in
+                                      (workbook.iterdir() if workbook.is_dir() else [workbook])),
+                'sizes': None if args.workbook else {**sizes, 'seed': args.seed},
+                'repeat': args.repeat,
+                'ranges': run.chart_ranges,
+                'memory_budget_mb': run.memory_budget_mb,
+                'output_format': run.output_format,
+            },
+            'charts': charts,
+            'modules': modules,
+        }
+
+    output = args.output or REPO_ROOT / 'benchmarks' / 'results' / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+# synthetic.py
+"""
+Generate a synthetic Seiya2 weekly report workbook.
+
+Every sheet has the columns, key values and null tokens the report modules
+expect, with random values, so the full report can be rendered at any size.
+
+    python benchmarks/synthetic.py data/raw/synthetic.xlsx --days 730 --affcodes 50
+    python benchmarks/synthetic.py data/raw/synthetic --format parquet
+"""
+import argparse
+import sys
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+from seiya2_viz.core import sources
+
+ZONE_TYPES = ['Server Open 24Months+', 'Server Open 12Months+', 'Server Open 6Months+',
+              'Server Open 3Months+', 'Server Open 3Months-', 'Potential Internal User']
+VIP_TYPES = ['Whale', 'Super R', 'Big R', 'Medium R', 'Small R', 'Non-R or Cross-server New Role']
+SERVER_TYPES = ['xiaoqi', 'mix', 'ios']
+SALES_INDEXES = ['198_below', 198, 328, 648, 1296, 2592, 5184, 7776, 11110, 50000]
+REG_MONTHS = ['202301', '202302', '202303', '202304']
+
+# ODPS writes SQL NULL as '\N'
+NULL_TOKEN = r'\N'
+
+DEFAULT_SIZES = {
+    'days': 200,          # days of history in the daily sheets
+    'affcodes': 20,       # channels in KPI_CHANNEL
+    'activity_types': 15, # spend types (a_typ) in CUR_SPEND
+    'zones': 6,           # server zones in KPI_ZONE
+    'user_types': 12,     # user sources in KPI_ZONE
+    'zone_days': 80,      # days of history in KPI_ZONE
+    'heroes': 30,         # characters in HERO_HOLD
+    'cards': 3,           # cards per soulstone box
+}
+
+
+def _with_nulls(series: pd.Series, every: int) -> pd.Series:
+    """Replace every n-th value with the ODPS null token."""
+    series = series.astype(object)
+    series.iloc[::every] = NULL_TOKEN
+    return series
+
+
+def _activity_sheet(rng, days, extra=(), cards=0) -> pd.DataFrame:
+    """One row per (activity day, zone type, VIP type[, card]); activities run weekly."""
+    card_ids = ['total'] + [f'c{i}' for i in range(1, cards + 1)] if cards else [None]
+    index = pd.MultiIndex.from_product([days[::7], ZONE_TYPES, VIP_TYPES, card_ids],
+                                       names=['day', 'zonetype', 'viptype', 'card_id'])
+    df = index.to_frame(index=False)
+    n = len(df)
+    df['au'] = rng.integers(1, 1000, n)
+    df['pu'] = rng.integers(0, 500, n)
+    df['freediamond'] = rng.integers(0, 100000, n)
+    df['paiddiamond'] = rng.integers(0, 100000, n)
+    for column in extra:
+        df[column] = rng.integers(0, 10000, n)
+    if cards:
+        df['card_name'] = df['card_id'] + '_name'
+    else:
+        df = df.drop(columns='card_id')
+    return df
+
+
+def generate_sheets(seed=0, **sizes) -> dict:
+    """
+    Build every sheet of the workbook as a DataFrame.
+
+    Args:
+        seed: Random seed; the same seed and sizes give the same workbook.
+        **sizes: Overrides of DEFAULT_SIZES.
+
+    Returns:
+        A dict of sheet name -> DataFrame, in workbook order.
+    """
+    sizes = {**DEFAULT_SIZES, **sizes}
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2024-01-01', periods=sizes['days'])
+    days = dates.strftime('%Y%m%d').astype(int)
+    weeks = dates[::7]
+    n_days, n_weeks = len(dates), len(weeks)
+    sheets = {}
+
+    sheets['KPI_WKLY'] = pd.DataFrame({
+        'week': weeks.strftime('%Y%m%d').astype(int), 'weekid': range(n_weeks), 'md': weeks.strftime('%m%d'),
+        'wou': rng.integers(10000, 20000, n_weeks), 'wnu': rng.integers(1000, 5000, n_weeks),
+        'wau': rng.integers(15000, 30000, n_weeks), 'sales': rng.integers(1_000_000, 5_000_000, n_weeks)})
+
+    sheets['KPI_DAILY'] = pd.DataFrame({
+        'day': days, 'dou': rng.integers(5000, 15000, n_days), 'dnu': rng.integers(100, 900, n_days),
+        'dau': rng.integers(8000, 20000, n_days), 'sales': rng.integers(100_000, 900_000, n_days),
+        'arpu': rng.random(n_days), 'arppu': rng.random(n_days) * 100, 'payrate': rng.random(n_days) / 10})
+
+    weekly = pd.DataFrame({'weekid': range(n_weeks), 'week': weeks.strftime('%Y%m%d').astype(int),
+                           'md': weeks.strftime('%m%d')})
+    channel = weekly.merge(pd.DataFrame({'affcode': [f'aff{i}' for i in range(sizes['affcodes'])]}), how='cross')
+    channel['wau'] = rng.integers(10, 1000, len(channel))
+    channel['wnu'] = rng.integers(1, 100, len(channel))
+    sheets['KPI_CHANNEL'] = channel
+
+    user = weekly[['week', 'weekid', 'md']].merge(pd.DataFrame({'regmonth2': REG_MONTHS}), how='cross')
+    user['wau'] = rng.integers(10, 1000, len(user))
+    user['wsales'] = rng.integers(1, 1000, len(user))
+    sheets['KPI_USER'] = user
+
+    spend = pd.MultiIndex.from_product(
+        [days, [f'act{i}' for i in range(sizes['activity_types'])]], names=['day', 'a_typ']).to_frame(index=False)
+    spend['totaldiamond'] = rng.integers(100, 10000, len(spend))
+    spend['paiddiamond'] = rng.integers(0, 5000, len(spend))
+    spend['backdiamond'] = _with_nulls(pd.Series(rng.integers(0, 100, len(spend))), 17)
+    sheets['CUR_SPEND'] = spend
+
+    stock = pd.DataFrame({'day': days})
+    for level in range(20):
+        stock[f'v{level:02d}'] = rng.integers(0, 100000, n_days)
+    sheets['CUR_STOCK'] = stock
+
+    heroes = sizes['heroes']
+    sheets['HERO_HOLD'] = pd.DataFrame({
+        'card_name': [f'hero{i}' for i in range(heroes)], 'core': rng.integers(0, 2, heroes),
+        'hu_tw': rng.integers(1000, 9000, heroes), 'hu_lw': rng.integers(1000, 9000, heroes),
+        'x1': 0, 'x2': 0, 'x3': 0})
+
+    zones = pd.DataFrame({'zone': [f'z{i}' for i in range(sizes['zones'])],
+                          'zone_type': [SERVER_TYPES[i % 3] for i in range(sizes['zones'])]})
+    zone = pd.DataFrame({'day': days[-sizes['zone_days']:]}).merge(zones, how='cross') \
+        .merge(pd.DataFrame({'user_type': [f'ut{i}' for i in range(sizes['user_types'])]}), how='cross')
+    zone['wnu'] = rng.integers(0, 100, len(zone))
+    zone['wsales'] = rng.integers(0, 1000, len(zone))
+    zone['x'] = 0
+    sheets['KPI_ZONE'] = zone
+
+    sales_index = pd.MultiIndex.from_product([days, SALES_INDEXES], names=['day', 'index']).to_frame(index=False)
+    sales_index['pu'] = rng.integers(1, 500, len(sales_index))
+    sales_index['x'] = 0
+    sheets['SALES_INDEX'] = sales_index
+
+    sheets['ACT_PRIZEWHEEL'] = _activity_sheet(rng, days, extra=('backdiamond',))
+    sheets['ACT_INTERZONE_FORCECARD'] = _activity_sheet(rng, days, extra=('sales',))
+    sheets['ACT_SOULSTONEBOX'] = _activity_sheet(rng, days, cards=sizes['cards'])
+    sheets['ACT_THEMEGACHA'] = _activity_sheet(rng, days, extra=('backdiamond', 'sales'))
+    sheets['ACT_WISHPOOL'] = _activity_sheet(rng, days, extra=('sales', 'cu'))
+    return sheets
+
+
+def write_workbook(path, seed=0, kind='excel', **sizes) -> Path:
+    """Generate the sheets and write them as a source of the given kind (an .xlsx workbook by default)."""
+    return sources.write_sheets(generate_sheets(seed, **sizes), path, kind)
+
+
+def add_size_arguments(parser: argparse.ArgumentParser):
+    """Add one --<size> option per entry of DEFAULT_SIZES."""
+    for name, default in DEFAULT_SIZES.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", dest=name, type=int, default=default,
+                            help=f'(default: {default})')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0).')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic Seiya2 weekly report workbook.')
+    parser.add_argument('output', help='Path of the .xlsx file (or directory, or database) to write.')
+    parser.add_argument('--format', choices=list(sources.SOURCE_TYPES), default='excel',
+                        help='Source format to write (default: excel).')
+    add_size_arguments(parser)
+    args = vars(parser.parse_args(argv))
+    output = args.pop('output')
+    seed = args.pop('seed')
+    kind = args.pop('format')
+    print(f"Workbook written to {write_workbook(output, seed, kind, **args)}")
+
+
+if __name__ == '__main__':
+    main()
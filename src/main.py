@@ -1,13 +1,156 @@
 # main.py
 
+import argparse
+import glob
+import os
 import time
-from seiya2_viz.utils import plotting
-from seiya2_viz.modules import kpi, currency, user_base, hero, activities
+from pathlib import Path
+# Only the lightweight config is imported up front: pandas, matplotlib and the
+# report modules are imported once a run starts, so --help returns immediately
+from seiya2_viz import config
 
-def main():
+def chart_range(text: str) -> tuple:
+    """Parse a --range item such as 'kpi.daily=365' into (chart id, periods)."""
+    chart_id, _, periods = text.partition('=')
+    try:
+        periods = int(periods)
+    except ValueError:
+        periods = 0
+    if not chart_id or periods < 1:
+        raise argparse.ArgumentTypeError(f"expected CHART=PERIODS with a positive number, got '{text}'")
+    return chart_id, periods
+
+def bounded_int(low: int, high: int = None):
+    """argparse type accepting an integer from `low` to `high` (no upper bound if None)."""
+    def parse(text: str) -> int:
+        try:
+            value = int(text)
+        except ValueError:
+            value = None
+        if value is None or value < low or (high is not None and value > high):
+            bounds = f'from {low} to {high}' if high is not None else f'of at least {low}'
+            raise argparse.ArgumentTypeError(f"expected an integer {bounds}, got '{text}'")
+        return value
+    return parse
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Generate the Seiya2 weekly report charts.')
+    parser.add_argument('--only', nargs='+', default=None, metavar='CHART',
+                        help="Render only these charts or modules, e.g. 'kpi.channel activities'. "
+                             "Only the sheets they need are read.")
+    parser.add_argument('--input', type=Path, default=None, metavar='PATH',
+                        help='Workbook to read instead of config.INPUT_FILE: an .xlsx file, a SQLite database or '
+                             'a directory of per-sheet CSV/TSV or Parquet files.')
+    parser.add_argument('--batch', nargs='+', default=None, metavar='WORKBOOK',
+                        help="Render several workbooks (files, directories or globs such as 'data/raw/*.xlsx'), "
+                             "each into its own subdirectory of the reports, sharing the -j worker pool.")
+    parser.add_argument('--watch', nargs='?', type=float, const=config.WATCH_INTERVAL, default=None, metavar='SECONDS',
+                        help='Keep running and re-render the changed charts whenever the workbook (or a --batch '
+                             f'workbook) changes, polling every SECONDS (default: {config.WATCH_INTERVAL}).')
+    parser.add_argument('--range', nargs='+', type=chart_range, default=[], metavar='CHART=N',
+                        help="Show the latest N periods (days, weeks or activity rounds) in these charts, "
+                             "e.g. 'kpi.daily=365 currency.stock=365'. --list shows the default ranges.")
+    parser.add_argument('--list', action='store_true',
+                        help='List the available charts and the sheets they read, then exit.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of worker processes used to render charts (default: 1, sequential).')
+    parser.add_argument('--force', action='store_true',
+                        help='Re-render every chart, even those whose inputs are unchanged.')
+    # Flags default to None, not False, so that only the options given override config.py
+    parser.add_argument('--stream', action='store_true', default=None,
+                        help='Stream time-series sheets and keep only the date window each chart needs.')
+    parser.add_argument('--memory-budget', type=bounded_int(1), default=None, metavar='MB',
+                        help='Read the largest sheets in chunks that fit this many MB and aggregate as they go.')
+    parser.add_argument('--prefetch', nargs='?', type=bounded_int(1), const=os.cpu_count(), default=None, metavar='N',
+                        help='Parse the sheets the charts need in N worker processes before rendering '
+                             '(default: one per CPU). With -j, the render workers already parse in parallel.')
+    parser.add_argument('--pipeline', action='store_true', default=None,
+                        help='Load the next charts\' sheets on a background thread while the current chart renders '
+                             '(in-process runs only) and report where each side waited.')
+    parser.add_argument('--ingest', action='store_true',
+                        help='Append the new days/weeks of the workbook to the local history store first.')
+    parser.add_argument('--history', action='store_true', default=None,
+                        help='Read the KPI, currency and user-base sheets from the history store.')
+    parser.add_argument('--format', choices=config.OUTPUT_FORMATS, default=None,
+                        help=f'Image format (default: {config.OUTPUT_FORMAT}).')
+    parser.add_argument('--dpi', type=bounded_int(1), default=None,
+                        help='Resolution of raster images (default: the figure DPI).')
+    parser.add_argument('--quality', type=bounded_int(1, 100), default=None,
+                        help='JPEG/WebP quality, 1-100 (default: encoder default).')
+    parser.add_argument('--trace-memory', action='store_true', default=None,
+                        help='Record the peak memory of every stage in the run report (slower).')
+    parser.add_argument('--profile', nargs='+', default=None, metavar='CHART',
+                        help="Run the given charts (e.g. 'kpi.channel') under cProfile.")
+    return parser.parse_args(argv)
+
+def resolve_workbooks(patterns) -> list:
+    """
+    Expand workbook paths, directories and glob patterns to workbooks.
+
+    Workbooks are any source core.sources can read. A directory that is not
+    itself a source (e.g. data/raw/) stands for the sources inside it.
+
+    Raises:
+        ValueError: If nothing matches, or two workbooks share a file name
+            (their reports would go to the same directory).
+    """
+    from seiya2_viz.core.sources import detect_kind
+    workbooks = []
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir() and detect_kind(path) is None:
+            matches = sorted(child for child in path.iterdir() if detect_kind(child))
+        elif glob.has_magic(pattern):
+            matches = sorted(Path(match) for match in glob.glob(pattern))
+        else:
+            matches = [path]
+        # Skip Excel's lock files of open workbooks
+        workbooks.extend(match for match in matches if not match.name.startswith('~$'))
+    workbooks = list(dict.fromkeys(workbooks))
+    if not workbooks:
+        raise ValueError(f"No workbooks match {' '.join(patterns)}")
+    stems = [workbook.stem for workbook in workbooks]
+    duplicates = sorted({stem for stem in stems if stems.count(stem) > 1})
+    if duplicates:
+        raise ValueError(f"Several workbooks are named {', '.join(duplicates)}; rename them to render them in one batch")
+    return workbooks
+
+def main(argv=None):
     """
-    Main function to execute all weekly report chart generation in sequence.
+    Main function to execute all weekly report chart generation.
     """
+    args = parse_args(argv)
+    from seiya2_viz.core import context, loader, runner
+    from seiya2_viz.utils import plotting
+
+    if args.list:
+        for chart_id in runner.list_charts():
+            chart = runner.get_chart(chart_id)
+            periods = f"range {chart['range']}" if 'range' in chart else ''
+            print(f"{chart_id:<28} {chart['sheet']:<26} {periods}".rstrip())
+        return
+    try:
+        chart_ids = runner.select_charts(args.only)
+        workbooks = resolve_workbooks(args.batch) if args.batch else []
+        ranges = dict(args.range)
+        for chart_id in ranges:
+            runner.select_charts([chart_id])  # unknown charts raise
+            if '.' not in chart_id or 'range' not in runner.get_chart(chart_id):
+                raise ValueError(f"Chart '{chart_id}' has no configurable range")
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return
+
+    # Command-line settings override config.py for this run only
+    settings = {
+        'STREAMING_LOAD': args.stream, 'USE_HISTORY': args.history, 'MEMORY_BUDGET_MB': args.memory_budget,
+        'OUTPUT_FORMAT': args.format, 'OUTPUT_DPI': args.dpi, 'OUTPUT_QUALITY': args.quality,
+        'PREFETCH_JOBS': args.prefetch, 'PIPELINE': args.pipeline,
+        'CHART_RANGES': {**config.CHART_RANGES, **ranges},
+        'TRACE_MEMORY': args.trace_memory, 'PROFILE_CHARTS': args.profile,
+    }
+    base = context.RunContext(args.input, **{name: value for name, value in settings.items() if value is not None})
+    runs = [base.for_workbook(workbook) for workbook in workbooks] or [base]
     start_time = time.time()
     print("=========================================")
     print("  Seiya2 Weekly Report Generation Start  ")
@@ -16,14 +159,53 @@ def main():
     # 1. Set chart style
     plotting.setup_matplotlib_style()
 
-    # 2. Generate various types of charts
-    kpi.generate_all()
-    currency.generate_all()
-    user_base.generate_all()
-    hero.generate_all()
-    activities.generate_all()
+    # Watch mode: stay warm and re-render as workbooks change
+    if args.watch is not None:
+        from seiya2_viz.core.watch import Watcher
+        if args.jobs > 1:
+            print("Watch mode renders in this process to keep it warm; -j is ignored.")
+
+        def find_runs():
+            if not args.batch:
+                return [base]
+            try:
+                return [base.for_workbook(workbook) for workbook in resolve_workbooks(args.batch)]
+            except ValueError:
+                return []
+
+        Watcher(find_runs, chart_ids, interval=args.watch, ingest=args.ingest).run_forever()
+        return
+
+    # 2. Optionally add this week's rows to the history store(s)
+    if args.ingest:
+        from seiya2_viz.core.history import HistoryStore
+        for run in runs:
+            with context.use(run):
+                try:
+                    with loader.WorkbookSession(use_history=False) as source, HistoryStore() as store:
+                        store.ingest(source)
+                except (OSError, ValueError) as e:
+                    print(f"ERROR: Could not ingest '{run.input_file}' into the history store: {e}")
+
+    # 3. Generate the charts, one workbook session per workbook
+    with context.use(base):
+        if args.batch:
+            batches = runner.run_batch(runs, chart_ids, jobs=args.jobs, force=args.force)
+            loader.close_session()
+        else:
+            with loader.open_session():
+                batches = [runner.run_charts(chart_ids, jobs=args.jobs, force=args.force)]
 
     end_time = time.time()
+    for run, results in zip(runs, batches):
+        with context.use(run):
+            runner.print_summary(results, heading=f'{run.label} Chart Status' if run.label else 'Chart Status Summary')
+            runner.write_run_report(results, end_time - start_time, jobs=args.jobs)
+    if args.batch:
+        counts = {status: sum(result['status'] == status for results in batches for result in results)
+                  for status in ('ok', 'skipped', 'failed')}
+        print(f"\n--- Batch Summary ---\n  {len(runs)} workbook(s): {counts['ok']} chart(s) rendered, "
+              f"{counts['skipped']} unchanged, {counts['failed']} failed.")
     print("\n========================================")
     print(f"  Report Generation Finished in {end_time - start_time:.2f} seconds.")
     print("========================================")
@@ -1,6 +1,7 @@
 # config.py
 from pathlib import Path
-import matplotlib.pyplot as plt
+# cycler is what pyplot re-exports; importing it directly keeps pyplot out of startup
+from cycler import cycler
 
 # -----------------
 # Path Configuration (Modify based on your environment)
@@ -9,11 +10,77 @@ import matplotlib.pyplot as plt
 PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
 # Input Excel file path
 INPUT_FILE = PROJECT_ROOT / 'data' / 'raw' / 'SEIYA2CN_WKLYREPORT_version3.xlsx'
-# Output directory for generated images
+# Format of INPUT_FILE: 'excel', 'csv' (directory of <SHEET>.csv/.tsv files), 'parquet'
+# (directory of <SHEET>.parquet files) or 'sqlite' (one table per sheet); None detects it from the path
+INPUT_FORMAT = None
+# Output directory for generated images (created when the first file is written)
 OUTPUT_DIR = PROJECT_ROOT / 'reports'
 
-# Ensure the output directory exists
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+# -----------------
+# Sheet Cache Configuration
+# -----------------
+# Cleaned sheets are cached on disk, keyed by the workbook's content hash
+CACHE_ENABLED = True
+CACHE_DIR = PROJECT_ROOT / '.cache' / 'sheets'
+# Upper bound for the cache; least recently used workbook versions are evicted first
+CACHE_MAX_MB = 512
+
+# Stream time-series sheets row by row and keep only the date window each chart needs
+STREAMING_LOAD = False
+# Memory budget (MB) for the largest sheets: charts marked 'chunked' read their
+# sheet in chunks and aggregate as they go. None loads every sheet whole.
+MEMORY_BUDGET_MB = None
+# Worker processes parsing the sheets of a run in parallel before its charts
+# render in this process; 0 parses each sheet when its first chart needs it
+PREFETCH_JOBS = 0
+# Load the next charts' sheets on a background thread while the current chart
+# renders; at most PIPELINE_DEPTH charts are loaded and not yet rendered
+PIPELINE = False
+PIPELINE_DEPTH = 2
+
+# Latest periods (days, weeks or activity rounds, as the chart counts them) a
+# chart shows, overriding its default range, e.g. {'kpi.daily': 365}. The
+# chart's window grows to match, so streamed and history reads fetch them all.
+CHART_RANGES = {}
+
+# Seconds between polls of the watched workbooks in watch mode (--watch)
+WATCH_INTERVAL = 5
+
+# -----------------
+# History Store Configuration
+# -----------------
+# SQLite store accumulating the time-series sheets of every ingested workbook
+HISTORY_DB = PROJECT_ROOT / 'data' / 'history.sqlite'
+# Read the KPI, currency and user-base sheets from the history store instead of the workbook
+USE_HISTORY = False
+
+# -----------------
+# Image Output Configuration
+# -----------------
+# Image format, one of OUTPUT_FORMATS
+OUTPUT_FORMATS = ('jpg', 'png', 'webp', 'svg')
+OUTPUT_FORMAT = 'jpg'
+# Resolution of raster images; None uses the figure's own DPI
+OUTPUT_DPI = None
+# JPEG/WebP quality (1-100); None uses the encoder default
+OUTPUT_QUALITY = None
+# Background threads encoding and writing images while the next chart is drawn
+OUTPUT_WRITERS = 2
+# Images waiting for a writer before save_plot blocks, so raster buffers do not pile up
+OUTPUT_QUEUE = 4
+# Points per line the long time-series charts (daily KPIs, diamond holdings)
+# hand to matplotlib; longer lines are downsampled with LTTB. None plots every point.
+MAX_POINTS = 500
+# Pivot tables kept by the plotting helpers' pivot cache; least recently used are evicted first
+PIVOT_CACHE_SIZE = 32
+
+# -----------------
+# Instrumentation
+# -----------------
+# Trace peak memory of every stage with tracemalloc (slows the run down noticeably)
+TRACE_MEMORY = False
+# Chart ids (e.g. 'kpi.channel') to run under cProfile; stats go to OUTPUT_DIR/profiles/
+PROFILE_CHARTS = []
 
 # -----------------
 # Chart Style Configuration
@@ -38,7 +105,7 @@ def get_plot_style():
         "xtick.color": "#191919",
         "xtick.labelsize": 12,
         "axes.edgecolor": "#191919",
-        "axes.prop_cycle": plt.cycler('color',
+        "axes.prop_cycle": cycler('color',
                                     ['#006767', '#ff7f0e', '#2ca02c', '#d62728',
                                      '#9467bd', '#8c564b', '#e377c2', '#7f7f7f',
                                      '#bcbd22', '#17becf']),
@@ -0,0 +1,183 @@
+# cache.py
+import hashlib
+import os
+import re
+import shutil
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+
+def file_digest(path, chunk_size=1 << 20) -> str:
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+_NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_NS_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+# Cells of type "s" hold an index into the shared strings table
+_SHARED_STRING_REF = re.compile(rb'<(?:\w+:)?c\b[^>]*\bt="s"[^>]*>\s*<(?:\w+:)?v>(\d+)<')
+
+
+def _read_shared_strings(zf: zipfile.ZipFile) -> list:
+    if 'xl/sharedStrings.xml' not in zf.namelist():
+        return []
+    root = ET.fromstring(zf.read('xl/sharedStrings.xml'))
+    return [''.join(t.text or '' for t in si.iter(f'{_NS_MAIN}t')) for si in root.iter(f'{_NS_MAIN}si')]
+
+
+def xlsx_sheet_digests(path, sheets=None) -> dict:
+    """
+    Return a content digest for the worksheets of an .xlsx workbook.
+
+    Each digest covers the worksheet XML and the shared strings it references,
+    so it only changes when that sheet's data changes. Nothing is parsed
+    beyond the zip directory and the XML of the shared strings table, which
+    makes this far cheaper than loading the sheets.
+
+    Args:
+        path: Workbook path.
+        sheets: Names of the sheets to digest. Defaults to every sheet; other
+            sheets are not even decompressed.
+    """
+    digests = {}
+    with zipfile.ZipFile(path) as zf:
+        workbook = ET.fromstring(zf.read('xl/workbook.xml'))
+        rels = ET.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+        targets = {rel.get('Id'): rel.get('Target') for rel in rels}
+        shared_strings = None
+
+        for sheet in workbook.iter(f'{_NS_MAIN}sheet'):
+            if sheets is not None and sheet.get('name') not in sheets:
+                continue
+            target = targets[sheet.get(f'{_NS_REL}id')]
+            part = target.lstrip('/') if target.startswith('/') else f'xl/{target}'
+            data = zf.read(part)
+            digest = hashlib.sha256(data)
+            for index in _SHARED_STRING_REF.findall(data):
+                if shared_strings is None:
+                    shared_strings = _read_shared_strings(zf)
+                digest.update(shared_strings[int(index)].encode('utf-8'))
+                digest.update(b'\0')
+            digests[sheet.get('name')] = digest.hexdigest()
+    return digests
+
+
+def _entry_name(sheet_name: str, usecols_key) -> str:
+    """Build a file-system safe entry name from a sheet name and its usecols."""
+    cols_digest = hashlib.sha1(repr(usecols_key).encode('utf-8')).hexdigest()[:12]
+    safe_sheet = ''.join(c if c.isalnum() or c in '-_' else '_' for c in sheet_name)
+    return f'{safe_sheet}__{cols_digest}'
+
+
+def _write_atomic(path: Path, write):
+    """Write a file with `write(temp_path)` and move it into place, so readers never see a partial file."""
+    temp_path = path.with_name(f'{path.name}.{os.getpid()}-{threading.get_ident()}.tmp')
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+
+class SheetCache:
+    """
+    On-disk cache of cleaned sheets.
+
+    Entries live in one directory per workbook version (its content hash), so
+    a new workbook simply starts a new directory. The directory's mtime is
+    refreshed on every hit and whole versions are evicted in least recently
+    used order once the cache grows beyond `max_mb`.
+
+    Frames are stored as Parquet when pyarrow is available. Frames pyarrow
+    cannot represent (e.g. columns mixing numbers and strings) and
+    environments without pyarrow fall back to pickle.
+
+    Several processes (e.g. -j workers) may share the cache: entries are
+    written to a temporary file and renamed into place, and a version another
+    process evicts meanwhile is simply a miss.
+    """
+
+    def __init__(self, directory, max_mb=512):
+        self.directory = Path(directory)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+
+    def _version_dir(self, fingerprint: str) -> Path:
+        return self.directory / fingerprint[:16]
+
+    def get(self, fingerprint: str, sheet_name: str, usecols_key) -> pd.DataFrame | None:
+        """Return the cached frame, or None on a miss."""
+        version_dir = self._version_dir(fingerprint)
+        entry = version_dir / _entry_name(sheet_name, usecols_key)
+        parquet_path = entry.with_suffix('.parquet')
+        pickle_path = entry.with_suffix('.pkl')
+        try:
+            if HAS_PYARROW and parquet_path.exists():
+                df = pd.read_parquet(parquet_path)
+            elif pickle_path.exists():
+                df = pd.read_pickle(pickle_path)
+            else:
+                return None
+        except Exception as e:
+            print(f"Ignoring unreadable cache entry for '{sheet_name}': {e}")
+            return None
+        try:
+            os.utime(version_dir)
+        except FileNotFoundError:
+            pass  # Evicted by another process since it was read
+        return df
+
+    def put(self, fingerprint: str, sheet_name: str, usecols_key, df: pd.DataFrame):
+        """Store a cleaned frame and evict old workbook versions if needed."""
+        version_dir = self._version_dir(fingerprint)
+        entry = version_dir / _entry_name(sheet_name, usecols_key)
+        try:
+            version_dir.mkdir(parents=True, exist_ok=True)
+            try:
+                if not HAS_PYARROW:
+                    raise ImportError('pyarrow is not installed')
+                _write_atomic(entry.with_suffix('.parquet'), df.to_parquet)
+            except Exception:
+                entry.with_suffix('.parquet').unlink(missing_ok=True)
+                _write_atomic(entry.with_suffix('.pkl'), df.to_pickle)
+        except OSError as e:
+            # The cache only saves time: the frame is still returned to the caller
+            print(f"Could not cache sheet '{sheet_name}': {e}")
+            return
+        self.evict(keep=version_dir)
+
+    def evict(self, keep=None):
+        """Remove least recently used workbook versions until within budget."""
+        if not self.directory.exists():
+            return
+        versions = []
+        total = 0
+        for version_dir in self.directory.iterdir():
+            if not version_dir.is_dir():
+                continue
+            try:
+                size = sum(f.stat().st_size for f in version_dir.iterdir())
+                versions.append((version_dir.stat().st_mtime, size, version_dir))
+            except FileNotFoundError:
+                continue  # Evicted or replaced by another process meanwhile
+            total += size
+
+        for _, size, version_dir in sorted(versions):
+            if total <= self.max_bytes:
+                break
+            if version_dir == keep:
+                continue
+            shutil.rmtree(version_dir, ignore_errors=True)
+            total -= size
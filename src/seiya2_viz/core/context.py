@@ -0,0 +1,92 @@
+# context.py
+import contextvars
+from contextlib import contextmanager
+from pathlib import Path
+from .. import config
+
+# Settings a run may override (e.g. from the command line); they travel with
+# the context into worker processes
+RUN_SETTINGS = ('STREAMING_LOAD', 'USE_HISTORY', 'MEMORY_BUDGET_MB', 'PREFETCH_JOBS', 'PIPELINE', 'CHART_RANGES',
+                'OUTPUT_FORMAT', 'OUTPUT_DPI', 'OUTPUT_QUALITY', 'TRACE_MEMORY', 'PROFILE_CHARTS')
+
+_active = contextvars.ContextVar('run_context', default=None)
+
+
+def _workbook_history(history_db: Path, input_file: Path) -> Path:
+    """History store of a workbook, named after it next to `history_db` (e.g. data/history_SEIYA2TW_WKLYREPORT.sqlite)."""
+    return history_db.with_name(f'{history_db.stem}_{input_file.stem}{history_db.suffix}')
+
+
+class RunContext:
+    """
+    Everything one report run depends on besides the code: the workbook it
+    reads, where its images, manifest and run report go, and its settings.
+
+    The loader, save_plot and the runner read the active context instead of
+    the module-level config, so several workbooks can be rendered in one
+    process or one worker pool. Contexts are plain picklable objects and are
+    sent along with every chart handed to a worker.
+
+    Args:
+        input_file: Workbook to read. Defaults to config.INPUT_FILE.
+        output_dir: Directory for the report. Defaults to config.OUTPUT_DIR.
+        history_db: History store of this workbook's series. Defaults to
+            config.HISTORY_DB for config.INPUT_FILE and to a store named after
+            the workbook for any other, so workbooks never share a store.
+        label: Short name shown in progress output (batch runs only).
+        **settings: Overrides of RUN_SETTINGS, e.g. OUTPUT_FORMAT='png'.
+            Settings not given are taken from config.
+    """
+
+    def __init__(self, input_file=None, output_dir=None, history_db=None, label=None, **settings):
+        unknown = sorted(set(settings) - set(RUN_SETTINGS))
+        if unknown:
+            raise ValueError(f"Unknown run setting(s): {', '.join(unknown)}")
+        self.input_file = Path(input_file or config.INPUT_FILE)
+        self.output_dir = Path(output_dir or config.OUTPUT_DIR)
+        if history_db is None and self.input_file.resolve() != Path(config.INPUT_FILE).resolve():
+            history_db = _workbook_history(Path(config.HISTORY_DB), self.input_file)
+        self.history_db = Path(history_db or config.HISTORY_DB)
+        self.label = label
+        for name in RUN_SETTINGS:
+            setattr(self, name.lower(), settings.get(name, getattr(config, name)))
+
+    def __repr__(self):
+        return f'RunContext({str(self.input_file)!r}, output_dir={str(self.output_dir)!r})'
+
+    def settings(self) -> dict:
+        """The context's RUN_SETTINGS as a dict."""
+        return {name: getattr(self, name.lower()) for name in RUN_SETTINGS}
+
+    def for_workbook(self, input_file) -> 'RunContext':
+        """
+        A context rendering another workbook with the same settings, into its
+        own subdirectory of this context's output directory.
+
+        The subdirectory and the workbook's history store are named after the
+        workbook file (e.g. reports/SEIYA2TW_WKLYREPORT/).
+        """
+        input_file = Path(input_file)
+        history_db = _workbook_history(self.history_db, input_file)
+        return RunContext(input_file, self.output_dir / input_file.stem, history_db,
+                          label=input_file.stem, **self.settings())
+
+
+def active() -> RunContext | None:
+    """The context set with use(), or None outside a run."""
+    return _active.get()
+
+
+def current() -> RunContext:
+    """The active context; outside a run, one built from config."""
+    return _active.get() or RunContext()
+
+
+@contextmanager
+def use(run: RunContext):
+    """Make `run` the active context for the duration of the block."""
+    token = _active.set(run)
+    try:
+        yield run
+    finally:
+        _active.reset(token)
@@ -0,0 +1,187 @@
+# history.py
+import datetime
+import hashlib
+import sqlite3
+from pathlib import Path
+import pandas as pd
+from . import context
+from .schema import get_schema, parse_dtypes
+
+# Sheets kept in the history store -> partition column. A weekly export
+# replaces whole partitions (days or weeks), never single rows.
+HISTORY_SHEETS = {
+    'KPI_WKLY': 'weekid',
+    'KPI_DAILY': 'day',
+    'KPI_CHANNEL': 'weekid',
+    'KPI_USER': 'weekid',
+    'CUR_SPEND': 'day',
+    'CUR_STOCK': 'day',
+    'KPI_ZONE': 'day',
+    'SALES_INDEX': 'day',
+}
+
+_LOG_TABLE = '_ingest_log'
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _yyyymmdd(date: datetime.date) -> int:
+    return date.year * 10000 + date.month * 100 + date.day
+
+
+def _restore_dtypes(df: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    return df.astype({column: dtype for column, dtype in dtypes.items() if column in df.columns})
+
+
+class HistoryStore:
+    """
+    Local SQLite store accumulating the time-series sheets of every weekly
+    workbook, so charts can span more history than a single export holds.
+
+    Each sheet is one table. Ingesting a workbook only writes partitions
+    (values of the sheet's `day`/`weekid` column) the store does not have
+    yet, plus the latest stored partition, which an earlier export may have
+    cut off mid-week. Older partitions are never rewritten.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path or context.current().history_db)
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute(f'CREATE TABLE IF NOT EXISTS {_LOG_TABLE} '
+                               '(sheet TEXT, digest TEXT, workbook TEXT, rows INTEGER, ingested_at TEXT)')
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def has_sheet(self, sheet_name: str) -> bool:
+        """True if the sheet is kept in the store and has been ingested."""
+        if sheet_name not in HISTORY_SHEETS or not self.path.exists():
+            return False
+        row = self._connect().execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                      (sheet_name,)).fetchone()
+        return row is not None
+
+    def columns(self, sheet_name: str) -> list:
+        """Columns of a stored sheet, in table order."""
+        return [row[1] for row in self._connect().execute(f'PRAGMA table_info({_quote(sheet_name)})')]
+
+    def version(self, sheet_name: str) -> str:
+        """Hash identifying the sheet's current content in the store; changes with every ingest that writes rows."""
+        rows = self._connect().execute(f'SELECT rowid, digest FROM {_LOG_TABLE} WHERE sheet = ? AND rows > 0',
+                                       (sheet_name,)).fetchall()
+        return hashlib.sha256(repr(rows).encode('utf-8')).hexdigest()
+
+    def ingest(self, source, sheets=None) -> dict:
+        """
+        Append the new partitions of a workbook's sheets to the store.
+
+        Args:
+            source: A loader.WorkbookSession reading the workbook to ingest.
+            sheets: Sheets to ingest. Defaults to every sheet in HISTORY_SHEETS.
+
+        Returns:
+            A dict of sheet name -> number of rows written.
+        """
+        conn = self._connect()
+        written = {}
+        for sheet_name in sheets or HISTORY_SHEETS:
+            digest = source.sheet_digest(sheet_name)
+            seen = conn.execute(f'SELECT 1 FROM {_LOG_TABLE} WHERE sheet = ? AND digest = ?',
+                                (sheet_name, digest)).fetchone()
+            if seen:
+                print(f"History: '{sheet_name}' of this workbook is already ingested.")
+                written[sheet_name] = 0
+                continue
+            df = source.load_sheet(sheet_name)
+            with conn:
+                written[sheet_name] = self._append(conn, sheet_name, df)
+                conn.execute(f'INSERT INTO {_LOG_TABLE} VALUES (?, ?, ?, ?, ?)',
+                             (sheet_name, digest, str(source.path), written[sheet_name],
+                              datetime.datetime.now().isoformat(timespec='seconds')))
+            print(f"History: ingested {written[sheet_name]} row(s) of '{sheet_name}'.")
+        return written
+
+    def _append(self, conn, sheet_name: str, df: pd.DataFrame) -> int:
+        """Write the partitions of `df` that are new or the latest stored one. Runs inside a transaction."""
+        key = HISTORY_SHEETS[sheet_name]
+        table = _quote(sheet_name)
+        df = df.reset_index(drop=True)
+        if not self.has_sheet(sheet_name):
+            # Text columns may mix numbers and strings (e.g. SALES_INDEX 'index'); a
+            # BLOB column has no type affinity, so SQLite stores each value as given
+            mixed = {column: 'BLOB' for column in df.columns if df[column].dtype == object}
+            df.to_sql(sheet_name, conn, index=False, dtype=mixed)
+            conn.execute(f'CREATE INDEX {_quote(f"ix_{sheet_name}_{key}")} ON {table} ({_quote(key)})')
+            return len(df)
+
+        stored_keys = {row[0] for row in conn.execute(f'SELECT DISTINCT {_quote(key)} FROM {table}')}
+        latest = max(stored_keys, default=None)
+        incoming = df[key]
+        new_rows = ~incoming.isin(stored_keys)
+        if latest is not None:
+            new_rows |= incoming >= latest
+        df = df[new_rows]
+        if df.empty:
+            return 0
+
+        # Partitions present in both are replaced, not duplicated
+        replaced = sorted(set(df[key].tolist()) & stored_keys)
+        conn.executemany(f'DELETE FROM {table} WHERE {_quote(key)} = ?', [(value,) for value in replaced])
+        columns = set(self.columns(sheet_name))
+        for column in df.columns:
+            if column not in columns:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {_quote(column)}')
+        df.to_sql(sheet_name, conn, index=False, if_exists='append')
+        return len(df)
+
+    def read(self, sheet_name: str, window=None, chunk_rows=None):
+        """
+        Read a sheet's accumulated history.
+
+        Args:
+            sheet_name: Name of the sheet.
+            window: Optional loader.RowWindow; only its rows are queried.
+            chunk_rows: If set, return an iterator of frames of at most this many rows.
+
+        Returns:
+            The rows ordered by partition and ingestion order, with the
+            sheet's key columns restored as categoricals. The caller cleans
+            the frame like a freshly parsed sheet.
+        """
+        conn = self._connect()
+        table = _quote(sheet_name)
+        query, params = f'SELECT * FROM {table}', ()
+        if window is not None:
+            column = _quote(window.column)
+            if window.unit == 'days':
+                latest = conn.execute(f'SELECT MAX({column}) FROM {table}').fetchone()[0]
+                if latest is not None:
+                    latest = int(latest)
+                    start = datetime.date(latest // 10000, latest // 100 % 100, latest % 100) \
+                        - datetime.timedelta(days=window.last)
+                    query, params = f'{query} WHERE {column} >= ?', (_yyyymmdd(start),)
+            else:
+                query = (f'{query} WHERE {column} >= (SELECT MIN(v) FROM (SELECT DISTINCT {column} AS v '
+                         f'FROM {table} ORDER BY v DESC LIMIT {int(window.last)}))')
+        query += f' ORDER BY {_quote(HISTORY_SHEETS[sheet_name])}, rowid'
+        dtypes = parse_dtypes(get_schema(sheet_name))
+        if chunk_rows:
+            chunks = pd.read_sql_query(query, conn, params=params, chunksize=chunk_rows)
+            return (_restore_dtypes(df, dtypes) for df in chunks)
+        return _restore_dtypes(pd.read_sql_query(query, conn, params=params), dtypes)
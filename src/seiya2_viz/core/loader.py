@@ -1,32 +1,585 @@
 # data_loader.py
+import datetime
+import multiprocessing
+import pickle
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
 import pandas as pd
+from pandas.io.parsers import TextParser
 from .. import config
+from . import context
+from .cache import HAS_PYARROW, SheetCache
+from .history import HistoryStore
+from .schema import apply_schema, get_schema, parse_dtypes
+from .sources import open_source, resolve_usecols
+from .timeindex import set_time_index
+from ..utils import instrument
 
-def load_sheet(sheet_name: str, usecols=None) -> pd.DataFrame | None:
+# Bump when the shape of cleaned frames changes, so stale cache entries are ignored
+FRAME_VERSION = 3
+
+
+def _usecols_key(usecols):
+    """Return a hashable representation of a `usecols` argument."""
+    if usecols is None or isinstance(usecols, str):
+        return usecols
+    if callable(usecols):
+        return usecols
+    return tuple(usecols)
+
+
+def _clean(df: pd.DataFrame, sheet_name: str) -> pd.DataFrame:
+    """
+    Replace ODPS null value '\\N' with 0, apply the sheet's compact dtypes and,
+    for time-series sheets, index the rows by their sorted dates.
+    """
+    schema = get_schema(sheet_name)
+    df = apply_schema(df, schema)
+    if schema and schema.get('dates'):
+        df = set_time_index(df, schema['dates'][0])
+    return df
+
+
+def _date_ordinal(value) -> int:
+    """Convert a yyyymmdd value (int, float, str or datetime) to a day ordinal."""
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.toordinal()
+    value = int(value)
+    return datetime.date(value // 10000, value // 100 % 100, value % 100).toordinal()
+
+
+class RowWindow:
+    """
+    The most recent rows of a time-series sheet, as needed by a chart.
+
+    A window always keeps a superset of the rows the chart's own filter keeps,
+    so applying it while loading never changes the output.
+
+    Args:
+        column: The date column ('day', 'week' or 'weekid').
+        last: Size of the window.
+        unit: 'days' keeps rows within `last` calendar days of the latest
+            yyyymmdd date (inclusive). 'values' keeps the rows of the `last`
+            most recent distinct values of the column.
+    """
+
+    def __init__(self, column: str, last: int, unit='values'):
+        if unit not in ('days', 'values'):
+            raise ValueError(f"Unknown window unit '{unit}'")
+        self.column = column
+        self.last = last
+        self.unit = unit
+
+    def __repr__(self):
+        return f'RowWindow({self.column!r}, {self.last}, unit={self.unit!r})'
+
+    def key(self, value):
+        """Ordering key of a raw column value, or None if it has no date."""
+        if value is None or value == '':
+            return None
+        return _date_ordinal(value) if self.unit == 'days' else value
+
+    def select(self, values: pd.Series) -> pd.Series:
+        """Boolean mask of the `values` inside the window, judged against `values` alone."""
+        keys = {value: self.key(value) for value in values.dropna().unique()}
+        ordered = sorted({key for key in keys.values() if key is not None})
+        if not ordered:
+            return pd.Series(False, index=values.index)
+        floor = ordered[-1] - self.last if self.unit == 'days' else ordered[-min(self.last, len(ordered))]
+        return values.isin([value for value, key in keys.items() if key is not None and key >= floor])
+
+
+def _cell_value(value):
+    """Convert a cell value the way pandas' openpyxl reader does."""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+# Rough cost of one cell while a chunk is parsed: the raw Python value, its
+# row tuple and the parsed column data
+_BYTES_PER_CELL = 100
+
+
+def chunk_rows_for_budget(n_columns: int) -> int:
+    """
+    Rows per chunk for bounded-memory loading.
+
+    A quarter of the run's memory budget (MEMORY_BUDGET_MB) goes to the raw
+    chunk; the rest is left for its parsed copy and the consumer's running aggregate.
+    """
+    budget = (context.current().memory_budget_mb or 256) * 1024 ** 2 // 4
+    return max(1000, budget // (_BYTES_PER_CELL * max(n_columns, 1)))
+
+
+class WorkbookSession:
+    """
+    An open handle on the run's workbook, or any other source of its sheets
+    (see core.sources: CSV/TSV or Parquet directories, SQLite databases).
+
+    The workbook is opened once per session and every sheet requested through
+    it is parsed from that handle, instead of re-opening and unzipping the file
+    for each sheet. Cleaned sheets are kept so repeated requests are free, and
+    are persisted to the on-disk sheet cache so later runs against the same
+    workbook do not need to open it at all.
+    """
+
+    def __init__(self, path=None, use_cache=None, streaming=None, use_history=None):
+        run = context.current()
+        self.path = Path(path or run.input_file)
+        self.source = open_source(self.path)
+        self.streaming = run.streaming_load if streaming is None else streaming
+        self._frames = {}
+        self._fingerprint = None
+        self._sheet_digests = {}
+        use_cache = config.CACHE_ENABLED if use_cache is None else use_cache
+        self.cache = SheetCache(config.CACHE_DIR, config.CACHE_MAX_MB) if use_cache else None
+        # Sheets found in the history store are read from it instead of the workbook
+        use_history = run.use_history if use_history is None else use_history
+        self.history = HistoryStore(run.history_db) if use_history else None
+
+    @property
+    def fingerprint(self) -> str:
+        """Content hash of the workbook, computed once per session."""
+        if self._fingerprint is None:
+            self._fingerprint = self.source.fingerprint()
+        return self._fingerprint
+
+    def sheet_digests(self, sheet_names) -> dict:
+        """
+        Content hashes of the given sheets, computed in one pass without
+        parsing the workbook. Sheets that are not requested are not read.
+
+        Falls back to the whole-source hash where a source cannot hash single sheets.
+        Sheets read from the history store get the store's version instead.
+        """
+        if self.history is not None:
+            for name in sheet_names:
+                if name not in self._sheet_digests and self.history.has_sheet(name):
+                    self._sheet_digests[name] = f'history:{self.history.version(name)}'
+        missing = [name for name in sheet_names if name not in self._sheet_digests]
+        if missing:
+            try:
+                self._sheet_digests.update(self.source.sheet_digests(missing))
+            except (KeyError, OSError, ValueError, ET.ParseError, zipfile.BadZipFile):
+                pass
+            for name in missing:
+                self._sheet_digests.setdefault(name, None)
+        return {name: self._sheet_digests[name] or self.fingerprint for name in sheet_names}
+
+    def sheet_digest(self, sheet_name: str) -> str:
+        """Content hash of a single sheet; see sheet_digests()."""
+        return self.sheet_digests([sheet_name])[sheet_name]
+
+    @staticmethod
+    def _parse_rows(sheet_name: str, columns, rows) -> pd.DataFrame:
+        """Build a cleaned frame from raw row values."""
+        # Same type inference pd.read_excel applies to the raw cell values
+        parser = TextParser([columns] + list(rows), header=0, dtype=parse_dtypes(get_schema(sheet_name)))
+        return _clean(parser.read(), sheet_name)
+
+    def _stream(self, sheet_name: str, usecols, window: RowWindow) -> pd.DataFrame:
+        """
+        Read a sheet row by row, keeping only the rows inside `window`.
+
+        Rows are streamed through openpyxl's read-only iterator and rows that
+        fall out of the window are dropped as newer dates are seen, so memory
+        stays proportional to the window rather than the sheet's history.
+        """
+        header, rows = self.source.rows(sheet_name)
+        positions = resolve_usecols(header, usecols)
+        key_position = list(header).index(window.column)
+
+        buckets = {}  # window key -> [(row number, row values)]
+        floor = None  # keys below the floor can no longer enter the window
+        for row_number, row in enumerate(rows):
+            if not any(value is not None for value in row):
+                continue
+            key = window.key(row[key_position])
+            if key is None or (floor is not None and key < floor):
+                continue
+            if key not in buckets:
+                buckets[key] = []
+                if window.unit == 'days':
+                    floor = max(buckets) - window.last
+                    for stale in [k for k in buckets if k < floor]:
+                        del buckets[stale]
+                elif len(buckets) > window.last:
+                    del buckets[min(buckets)]
+                    floor = min(buckets)
+            row = row + (None,) * (len(header) - len(row))
+            buckets[key].append((row_number, tuple(_cell_value(row[i]) for i in positions)))
+
+        kept = sorted(item for bucket in buckets.values() for item in bucket)
+        columns = [header[i] for i in positions]
+        return self._parse_rows(sheet_name, columns, (values for _, values in kept))
+
+    def iter_chunks(self, sheet_name: str, usecols=None, window: RowWindow = None, chunk_rows=None):
+        """
+        Yield a sheet as cleaned frames of at most `chunk_rows` rows.
+
+        Nothing is cached, so memory is bounded by one chunk plus whatever the
+        consumer keeps. Rows already known to be outside `window` are
+        skipped, but a chunk may still hold rows that later turn out to be
+        too old; consumers apply the window to their combined result.
+
+        Args:
+            sheet_name: Name of the sheet to load.
+            usecols: Range of columns to load.
+            window: Optional RowWindow the caller needs.
+            chunk_rows: Rows per chunk. Defaults to what fits the memory budget.
+        """
+        if self.history is not None and self.history.has_sheet(sheet_name):
+            chunk_rows = chunk_rows or chunk_rows_for_budget(len(self.history.columns(sheet_name)))
+            for df in self.history.read(sheet_name, window, chunk_rows=chunk_rows):
+                yield _clean(df.iloc[:, resolve_usecols(list(df.columns), usecols)], sheet_name)
+            return
+        if not self.source.streams_rows:
+            dtype = parse_dtypes(get_schema(sheet_name))
+            columns = self.source.columns(sheet_name)
+            for df in self.source.read_chunks(sheet_name, usecols=usecols, dtype=dtype,
+                                              chunk_rows=chunk_rows or chunk_rows_for_budget(len(columns))):
+                yield _clean(df, sheet_name)
+            return
+
+        header, rows = self.source.rows(sheet_name)
+        positions = resolve_usecols(header, usecols)
+        columns = [header[i] for i in positions]
+        chunk_rows = chunk_rows or chunk_rows_for_budget(len(header))
+        key_position = list(header).index(window.column) if window is not None else None
+
+        top = set()  # the most recent window keys seen so far ('values' windows)
+        floor = None  # keys below the floor can no longer enter the window
+        chunk = []
+        for row in rows:
+            if not any(value is not None for value in row):
+                continue
+            if window is not None:
+                key = window.key(row[key_position])
+                if key is None or (floor is not None and key < floor):
+                    continue
+                if window.unit == 'days':
+                    floor = key - window.last if floor is None else max(floor, key - window.last)
+                elif key not in top:
+                    top.add(key)
+                    if len(top) > window.last:
+                        top.remove(min(top))
+                    if len(top) == window.last:
+                        floor = min(top)
+            row = row + (None,) * (len(header) - len(row))
+            chunk.append(tuple(_cell_value(row[i]) for i in positions))
+            if len(chunk) >= chunk_rows:
+                yield self._parse_rows(sheet_name, columns, chunk)
+                chunk = []
+        if chunk:
+            yield self._parse_rows(sheet_name, columns, chunk)
+
+    @instrument.timed('load')
+    def load_sheet(self, sheet_name: str, usecols=None, window: RowWindow = None) -> pd.DataFrame:
+        """
+        Parse a worksheet from the open workbook.
+
+        Args:
+            sheet_name: Name of the sheet to load.
+            usecols: Range of columns to load.
+            window: Rows the caller needs. Used in streaming mode, where an
+                Excel sheet is read row by row and rows outside the window are
+                never materialised, and for sheets read from the history store.
+
+        Returns:
+            A cleaned copy of the sheet. Errors are raised to the caller.
+        """
+        if self.history is not None and self.history.has_sheet(sheet_name):
+            return self._load_history(sheet_name, usecols, window)
+        key, window = self._frame_key(sheet_name, usecols, window)
+        if key not in self._frames:
+            df = self._cached(key)
+            if df is None:
+                if window is not None:
+                    df = self._stream(sheet_name, usecols, window)
+                else:
+                    df = self.source.read(sheet_name, usecols=usecols, dtype=parse_dtypes(get_schema(sheet_name)))
+                    df = _clean(df, sheet_name)
+                if self.cache is not None:
+                    self.cache.put(self.fingerprint, *key, df)
+            self._frames[key] = df
+        # Modules modify their frames in place, so never hand out the cached one
+        return self._frames[key].copy()
+
+    def _frame_key(self, sheet_name: str, usecols, window: RowWindow):
+        """Registry and disk cache key of a sheet read, and the window the read actually applies."""
+        if not (self.streaming and self.source.streams_rows):
+            window = None
+        # Cached frames depend on the schema they were cleaned with
+        schema = get_schema(sheet_name)
+        return (sheet_name, (FRAME_VERSION, _usecols_key(usecols), repr(window), repr(schema))), window
+
+    def _cached(self, key) -> pd.DataFrame | None:
+        return self.cache.get(self.fingerprint, *key) if self.cache is not None else None
+
+    def prefetch(self, requests, jobs: int) -> int:
+        """
+        Parse sheets in parallel worker processes ahead of load_sheet().
+
+        Parsing an Excel sheet is CPU-bound pure Python, so sheets parsed one
+        after another cost the sum of their parse times. Here every sheet not
+        yet in the session or the disk cache is parsed in its own worker;
+        the frames come back as Arrow IPC streams (pickle when pyarrow is
+        missing or cannot represent a frame) and are placed in the session
+        and the disk cache, where load_sheet() finds them.
+
+        Args:
+            requests: (sheet name, usecols, window) tuples, as passed to load_sheet().
+            jobs: Maximum number of worker processes.
+
+        Returns:
+            The number of sheets parsed. A sheet that fails to parse is left
+            to load_sheet(), which reports the error.
+        """
+        pending = {}
+        for sheet_name, usecols, window in requests:
+            if self.history is not None and self.history.has_sheet(sheet_name):
+                continue
+            key, window = self._frame_key(sheet_name, usecols, window)
+            if key in self._frames or key in pending:
+                continue
+            df = self._cached(key)
+            if df is not None:
+                self._frames[key] = df
+            else:
+                pending[key] = (sheet_name, usecols, window)
+        # A single sheet parses no faster in a worker
+        if len(pending) < 2:
+            return 0
+
+        parsed = 0
+        # Prefetch may run on the pipeline's loader thread while other threads draw and write:
+        # start the workers without forking this process
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        with ProcessPoolExecutor(max_workers=min(jobs, len(pending)), initializer=_init_prefetch_worker,
+                                 initargs=(self.path,), mp_context=multiprocessing.get_context(start_method)) as pool:
+            futures = {pool.submit(_parse_sheet, *request): key for key, request in pending.items()}
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    df = _decode_frame(*future.result())
+                except Exception as e:
+                    print(f"Prefetch of sheet '{key[0]}' failed; it is loaded when needed. Details: {e}")
+                    continue
+                self._frames[key] = df
+                if self.cache is not None:
+                    self.cache.put(self.fingerprint, *key, df)
+                parsed += 1
+        return parsed
+
+    def _load_history(self, sheet_name: str, usecols, window: RowWindow) -> pd.DataFrame:
+        """Query a sheet's window from the history store and clean it like a parsed sheet."""
+        key = (sheet_name, ('history', _usecols_key(usecols), repr(window)))
+        if key not in self._frames:
+            df = self.history.read(sheet_name, window)
+            df = df.iloc[:, resolve_usecols(list(df.columns), usecols)]
+            self._frames[key] = _clean(df, sheet_name)
+        return self._frames[key].copy()
+
+    def adopt(self, other: 'WorkbookSession'):
+        """
+        Take over the parsed frames of another session (e.g. on an earlier
+        revision of the workbook) for the sheets whose content is unchanged.
+
+        Sheets are compared by the digests `other` computed; frames of sheets
+        it never hashed are not taken over.
+        """
+        known = {name: digest for name, digest in other._sheet_digests.items()
+                 if digest and any(key[0] == name for key in other._frames)}
+        current = self.sheet_digests(list(known))
+        for key, df in other._frames.items():
+            if key[0] in known and current[key[0]] == known[key[0]]:
+                self._frames[key] = df
+
+    def close(self):
+        if self.history is not None:
+            self.history.close()
+        self.source.close()
+        self._frames.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _encode_frame(df: pd.DataFrame) -> tuple:
+    """Serialise a parsed frame in a prefetch worker: an Arrow IPC stream, or a protocol 5 pickle."""
+    if HAS_PYARROW:
+        import pyarrow as pa
+        try:
+            table = pa.Table.from_pandas(df)
+        except (pa.ArrowException, TypeError, ValueError):
+            # e.g. columns mixing numbers and strings
+            pass
+        else:
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            return 'arrow', sink.getvalue()
+    return 'pickle', pickle.dumps(df, protocol=5)
+
+
+def _decode_frame(kind: str, data) -> pd.DataFrame:
+    if kind == 'arrow':
+        import pyarrow as pa
+        return pa.ipc.open_stream(data).read_all().to_pandas()
+    return pickle.loads(data)
+
+
+# Session of a prefetch worker process, opened once for all the sheets it parses
+_worker_session = None
+
+
+def _init_prefetch_worker(path):
+    global _worker_session
+    # Requests carry the window load_sheet() applies, so the worker streams exactly when it is set
+    _worker_session = WorkbookSession(path, use_cache=False, streaming=True, use_history=False)
+
+
+def _parse_sheet(sheet_name: str, usecols, window: RowWindow) -> tuple:
+    """Prefetch worker: parse and clean one sheet and serialise it for the parent."""
+    df = _worker_session.load_sheet(sheet_name, usecols=usecols, window=window)
+    # The parent keeps the frame; do not hold a second copy here
+    _worker_session._frames.clear()
+    return _encode_frame(df)
+
+
+_session = None
+
+
+def get_session() -> WorkbookSession:
+    """
+    Return the active workbook session, opening one on first use.
+
+    Inside a run context (see core.context) the session follows the
+    context's workbook: a context naming another workbook closes the
+    current session and opens one on that workbook.
+    """
+    global _session
+    run = context.active()
+    if _session is not None and run is not None and _session.path != run.input_file:
+        close_session()
+    if _session is None:
+        _session = WorkbookSession()
+    return _session
+
+
+def open_session(path=None) -> WorkbookSession:
     """
-    Load a worksheet from the configured Excel file.
+    Open a new workbook session and make it the active one.
+
+    Use as a context manager so the workbook is closed when the run ends.
+    """
+    global _session
+    if _session is not None:
+        _session.close()
+    _session = WorkbookSession(path)
+    return _session
+
+
+def use_session(session: WorkbookSession):
+    """Make an existing session the active one; the previously active session is left open."""
+    global _session
+    _session = session
+
+
+def close_session():
+    """Close the active workbook session, if any."""
+    global _session
+    if _session is not None:
+        _session.close()
+        _session = None
+
+
+def prefetch(requests, jobs: int):
+    """
+    Parse the sheets of the charts about to render, in parallel, into the
+    active session (see WorkbookSession.prefetch).
+
+    Args:
+        requests: (sheet name, usecols, window) tuples, as passed to load_sheet().
+        jobs: Maximum number of worker processes.
+    """
+    start_time = time.time()
+    try:
+        parsed = get_session().prefetch(requests, jobs)
+    except Exception as e:
+        print(f"Prefetch failed; sheets are loaded when needed. Details: {e}")
+        return
+    if parsed:
+        print(f"Prefetched {parsed} sheet(s) over up to {jobs} worker(s) in {time.time() - start_time:.2f}s.")
+
+
+def load_sheet(sheet_name: str, usecols=None, window: RowWindow = None) -> pd.DataFrame | None:
+    """
+    Load a worksheet from the run's workbook (or other source).
 
     Args:
         sheet_name: Name of the sheet to load.
         usecols: Range of columns to load.
+        window: Optional RowWindow the caller needs, pushed down into the
+            read when streaming is enabled.
 
     Returns:
         A Pandas DataFrame, or None if failed.
     """
+    session = get_session()
     print(f"Loading sheet: '{sheet_name}'...")
     try:
-        df = pd.read_excel(config.INPUT_FILE, sheet_name=sheet_name, usecols=usecols)
-        # Replace ODPS null value '\N' with 0
-        df = df.replace(r'\N', 0).infer_objects(copy=False)
+        df = session.load_sheet(sheet_name, usecols=usecols, window=window)
         print(f"Successfully loaded and cleaned sheet: '{sheet_name}'.")
         return df
     except FileNotFoundError:
-        print(f"ERROR: Input file not found at '{config.INPUT_FILE}'.")
-        print("Please check the INPUT_FILE path in config.py.")
+        print(f"ERROR: {session.source.kind} source not found at '{session.path}'.")
+        print("Please check --input/--batch, or INPUT_FILE in config.py.")
         return None
     except ValueError as e:
-        print(f"ERROR: Sheet '{sheet_name}' not found in the Excel file. Details: {e}")
+        print(f"ERROR: Could not read sheet '{sheet_name}' from {session.source.kind} source '{session.path}'. "
+              f"Details: {e}")
         return None
     except Exception as e:
         print(f"An unexpected error occurred while loading sheet '{sheet_name}': {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+class SheetChunks:
+    """
+    A sheet handed to a chart as an iterable of cleaned chunks instead of one
+    frame, in bounded-memory mode (MEMORY_BUDGET_MB).
+
+    Processors that support it (see processors.combine_chunks) aggregate
+    each chunk and combine the partial results. Every iteration reads the
+    sheet again.
+    """
+
+    def __init__(self, sheet_name: str, usecols=None, window: RowWindow = None, session=None):
+        self.sheet_name = sheet_name
+        self.usecols = usecols
+        self.window = window
+        self.session = session or get_session()
+
+    def __iter__(self):
+        chunks = self.session.iter_chunks(self.sheet_name, usecols=self.usecols, window=self.window)
+        while True:
+            # Reading is timed as 'load' even though it runs inside the processor
+            with instrument.stage('load'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+
+
+def load_chunks(sheet_name: str, usecols=None, window: RowWindow = None) -> SheetChunks:
+    """Return a sheet as lazily read chunks; errors surface when it is iterated."""
+    print(f"Loading sheet in chunks: '{sheet_name}'...")
+    return SheetChunks(sheet_name, usecols=usecols, window=window)
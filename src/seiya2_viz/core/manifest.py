@@ -0,0 +1,97 @@
+# manifest.py
+import hashlib
+import json
+from pathlib import Path
+from .. import config
+from . import context
+
+PACKAGE_DIR = Path(__file__).resolve().parent.parent
+# Code shared by every chart; a change here invalidates all charts
+SHARED_SOURCE_DIRS = [PACKAGE_DIR / 'core', PACKAGE_DIR / 'utils']
+# Colors, labels, orders and limits read by every chart
+CONFIG_FILE = PACKAGE_DIR / 'config.py'
+
+
+def _digest_files(paths) -> str:
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        digest.update(path.name.encode('utf-8'))
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def code_version(module_name: str) -> str:
+    """Hash of a report module's source together with config.py and the shared core and utils code."""
+    paths = [PACKAGE_DIR / 'modules' / f'{module_name}.py', CONFIG_FILE]
+    for directory in SHARED_SOURCE_DIRS:
+        paths.extend(directory.glob('*.py'))
+    return _digest_files(paths)
+
+
+def style_digest() -> str:
+    """Hash of the matplotlib style applied to every chart."""
+    style = json.dumps(config.get_plot_style(), sort_keys=True, default=repr)
+    return hashlib.sha256(style.encode('utf-8')).hexdigest()
+
+
+def chart_fingerprint(chart_id: str, chart: dict, sheet_digest: str) -> str:
+    """
+    Fingerprint of everything a chart's output depends on.
+
+    Args:
+        chart_id: Chart id such as 'kpi.channel'.
+        chart: The chart's registry entry.
+        sheet_digest: Content hash of the sheet the chart reads.
+    """
+    module_name = chart_id.split('.', 1)[0]
+    run = context.current()
+    parts = [
+        chart_id,
+        chart['sheet'],
+        repr(chart.get('usecols')),
+        repr((chart.get('window'), chart.get('range'))),
+        sheet_digest,
+        code_version(module_name),
+        style_digest(),
+        repr((run.output_format, run.output_dpi, run.output_quality)),
+    ]
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+class Manifest:
+    """
+    Record of the fingerprint and output files of every chart rendered into
+    the run's output directory, used to skip charts whose inputs did not change.
+    """
+
+    FILENAME = 'manifest.json'
+
+    def __init__(self, output_dir=None):
+        self.path = Path(output_dir or context.current().output_dir) / self.FILENAME
+        self.entries = {}
+        if self.path.exists():
+            try:
+                self.entries = json.loads(self.path.read_text(encoding='utf-8'))
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable manifest '{self.path}': {e}")
+
+    def is_current(self, chart_id: str, fingerprint: str) -> bool:
+        """True if the chart was rendered with this fingerprint and its files still exist."""
+        entry = self.entries.get(chart_id)
+        if not entry or entry['fingerprint'] != fingerprint:
+            return False
+        return all((self.path.parent / output).exists() for output in entry['outputs'])
+
+    def record(self, chart_id: str, fingerprint: str, outputs):
+        output_dir = self.path.parent
+        self.entries[chart_id] = {
+            'fingerprint': fingerprint,
+            'outputs': [Path(output).relative_to(output_dir).as_posix() for output in outputs],
+        }
+
+    def discard(self, chart_id: str):
+        self.entries.pop(chart_id, None)
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self.entries, indent=2, sort_keys=True), encoding='utf-8')
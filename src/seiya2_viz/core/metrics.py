@@ -0,0 +1,71 @@
+# metrics.py
+import numpy as np
+from ..utils import instrument
+
+# -----------------
+# Derived Metric Definitions
+# -----------------
+# num:      columns summed into the numerator (all required)
+# optional: extra numerator columns, added only when the aggregate has them
+#           (e.g. 'backdiamond', returned diamonds counted as spend)
+# den:      denominator column; None for plain sums
+DERIVED_METRICS = {
+    # Free diamonds including returned diamonds
+    'freediamond_total': {'num': ['freediamond'], 'optional': ['backdiamond'], 'den': None},
+    # Participation rate
+    'pr': {'num': ['pu'], 'den': 'au'},
+    # Average diamond spend per participant
+    'avgdiamond': {'num': ['freediamond', 'paiddiamond'], 'optional': ['backdiamond'], 'den': 'pu'},
+    'arpu': {'num': ['sales'], 'den': 'au'},
+    'arppu': {'num': ['sales'], 'den': 'cu'},
+    'payrate': {'num': ['cu'], 'den': 'au'},
+}
+
+
+def safe_divide(numerator, denominator) -> np.ndarray:
+    """Element-wise division that yields 0 where the denominator is 0 (NaN stays NaN)."""
+    numerator = np.asarray(numerator, dtype='float64')
+    denominator = np.asarray(denominator, dtype='float64')
+    result = np.zeros(np.broadcast(numerator, denominator).shape)
+    np.divide(numerator, denominator, out=result, where=denominator != 0)
+    return result
+
+
+def _column(agg, name) -> np.ndarray:
+    return np.asarray(agg[name], dtype='float64')
+
+
+@instrument.timed('process')
+def evaluate(agg, names) -> dict:
+    """
+    Compute derived metrics over an aggregate.
+
+    `agg` is either an aggregated DataFrame or a dict of arrays (such as a
+    cube from `processors.build_cube`). Each metric is computed with NumPy in
+    a single pass over the base columns and stored back into `agg`, so later
+    charts asking for the same metric on the same aggregate reuse it.
+    Aggregates are therefore expected not to change once metrics are taken.
+
+    Args:
+        agg: Aggregated data.
+        names: Names of metrics in DERIVED_METRICS (or base columns).
+
+    Returns:
+        A dict of metric name -> ndarray, for every metric whose required
+        columns are present in `agg`.
+    """
+    results = {}
+    for name in names:
+        if name not in agg:
+            spec = DERIVED_METRICS.get(name)
+            if spec is None or not all(col in agg for col in spec['num']):
+                continue
+            if spec['den'] is not None and spec['den'] not in agg:
+                continue
+            numerator = sum(_column(agg, col) for col in spec['num'] + spec.get('optional', []) if col in agg)
+            if spec['den'] is None:
+                agg[name] = numerator
+            else:
+                agg[name] = safe_divide(numerator, _column(agg, spec['den']))
+        results[name] = _column(agg, name)
+    return results
@@ -0,0 +1,120 @@
+# pipeline.py
+import contextvars
+import queue
+import threading
+from .. import config
+from ..utils import instrument
+
+# Stages recording the time one side of the pipeline waited for another
+WAIT_STAGES = {
+    'load_wait': 'rendering waited for sheets to load',
+    'render_wait': 'loading waited for charts to render',
+    'write_wait': 'rendering waited for images to be written',
+}
+
+_DONE = object()
+
+
+class Pipeline:
+    """
+    Staged producer/consumer scheduler overlapping loading with rendering.
+
+    A loader thread runs `load` for the upcoming tasks while the caller
+    processes and draws the current one on its own thread (matplotlib is not
+    thread-safe), and the plotting writer threads encode and write the
+    images of earlier ones. Parts of reading a sheet (file I/O, zip
+    decompression, some of pandas' parsing) release the GIL and overlap
+    with drawing.
+
+    At most `depth` tasks are loaded and not yet rendered: the loader waits
+    for a free slot before loading the next one, so memory stays bounded
+    however slow rendering is. Both waits are recorded as stages of the
+    task they delay (see WAIT_STAGES), next to the loader's own stages.
+
+    Args:
+        tasks: Tasks to load and hand out, in order.
+        load: Called with each task on the loader thread; returns its data.
+        depth: Tasks loaded ahead, including the one rendering. Defaults to config.PIPELINE_DEPTH.
+        group: Optional callable mapping a task to a group (e.g. its workbook).
+            Before loading the first task of a new group, the loader waits
+            until every earlier task has been rendered.
+    """
+
+    def __init__(self, tasks, load, depth=None, group=None):
+        self.tasks = list(tasks)
+        self.load = load
+        self.depth = max(1, depth or config.PIPELINE_DEPTH)
+        self.group = group
+        self._slots = threading.Semaphore(self.depth)
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._error = None
+
+    def _acquire(self) -> bool:
+        """Take a slot, giving up when the consumer stops early."""
+        while not self._slots.acquire(timeout=0.1):
+            if self._stop.is_set():
+                return False
+        return True
+
+    def _produce(self):
+        previous = _DONE
+        try:
+            for task in self.tasks:
+                with instrument.stage('render_wait'):
+                    if self.group is not None and previous is not _DONE and self.group(task) != self.group(previous):
+                        # Take every slot: all earlier tasks are rendered
+                        taken = 0
+                        while taken < self.depth and self._acquire():
+                            taken += 1
+                        for _ in range(taken):
+                            self._slots.release()
+                    if not self._acquire():
+                        return
+                previous = task
+                data = self.load(task)
+                self._queue.put((task, data, instrument.collect_stages()))
+        except Exception as e:
+            # Raised again on the consumer's thread
+            self._error = e
+        finally:
+            self._queue.put(_DONE)
+
+    def __iter__(self):
+        """Yield (task, data, stages) in order; `stages` are the timed stages of loading the task."""
+        # The loader runs in a copy of the caller's context, e.g. its active run
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(self._produce,),
+                                  name='pipeline-loader', daemon=True)
+        thread.start()
+        try:
+            while True:
+                with instrument.stage('load_wait'):
+                    item = self._queue.get()
+                if item is _DONE:
+                    instrument.collect_stages()
+                    if self._error is not None:
+                        raise self._error
+                    return
+                task, data, stages = item
+                yield task, data, stages + instrument.collect_stages()
+                # The task is rendered: its slot goes back to the loader
+                self._slots.release()
+        finally:
+            self._stop.set()
+            thread.join()
+
+
+def summarize_waits(results) -> dict:
+    """Seconds spent in each of WAIT_STAGES, summed over the status dicts of a run."""
+    totals = dict.fromkeys(WAIT_STAGES, 0.0)
+    for result in results:
+        for name, entry in instrument.summarize(result.get('stages', [])).items():
+            if name in totals:
+                totals[name] += entry['wall']
+    return totals
+
+
+def print_waits(results):
+    """Print the pipeline's queue waits; the largest points at the bottleneck."""
+    totals = summarize_waits(results)
+    print("  Pipeline waits: " + ', '.join(f"{WAIT_STAGES[name]} {seconds:.2f}s" for name, seconds in totals.items()))
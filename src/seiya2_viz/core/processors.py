@@ -1,58 +1,205 @@
 # processors.py
+import numpy as np
 import pandas as pd
 from .. import config
+from . import loader, timeindex
+from ..utils import instrument
 
-def process_kpi_channel_data(df: pd.DataFrame) -> pd.DataFrame:
-    """Process KPI CHANNEL data, ranking and grouping channels by WAU."""
-    df_recent = df[df['weekid'] > (max(df['weekid']) - 6)].copy()
-    
-    # Rank affcode by sum of WAU
-    rkdk_channel = df_recent.groupby('affcode')['wau'].sum().reset_index()
-    rkdk_channel = rkdk_channel.sort_values(by='wau', ascending=False)
-    rkdk_channel['row_number'] = rkdk_channel['wau'].rank(ascending=False, method='first')
-    
-    # Merge ranking information
-    df_merged = pd.merge(df_recent, rkdk_channel[['affcode', 'row_number']], how='left', on='affcode')
-    
-    # Group low-ranking channels as 'others'
-    df_merged.loc[df_merged["row_number"] > 9, "affcode"] = 'others'
-    
-    # Re-aggregate by week, md, and affcode
-    df_processed = df_merged.groupby(['week', 'md', 'affcode']).agg({'wau': "sum", 'wnu': "sum"}).reset_index()
-    return df_processed
+def _sum_by(df: pd.DataFrame, dims: list, values: list) -> pd.DataFrame:
+    """Sum `values` per combination of `dims`, keeping first-seen order and null keys."""
+    # Chunks carry different categories; plain values combine across chunks
+    keys = df[dims].astype({col: object for col in dims if isinstance(df[col].dtype, pd.CategoricalDtype)})
+    return df[values].groupby([keys[col] for col in dims], sort=False, dropna=False).sum().reset_index()
 
-def process_cur_spend_data(df: pd.DataFrame) -> pd.DataFrame:
-    """Process currency consumption data, ranking and grouping consumption activities."""
-    df['date'] = pd.to_datetime(df.day, format='%Y%m%d')
-    df_recent = df[df['date'].isin(pd.date_range(df['date'].max() - pd.to_timedelta(90, unit="D"), df['date'].max()))].copy()
+@instrument.timed('process')
+def combine_chunks(chunks, dims: list) -> pd.DataFrame:
+    """
+    Reduce a sheet read in chunks to one row per combination of `dims`.
 
-    # Rank consumption activities (a_typ)
-    rkdc_spend = df_recent.groupby('a_typ')['totaldiamond'].sum().reset_index()
-    rkdc_spend = rkdc_spend.sort_values(by='totaldiamond', ascending=False).reset_index(drop=True)
-    rkdc_spend['row_number'] = rkdc_spend['totaldiamond'].rank(ascending=False, method='first')
+    Each chunk is summed on its own and the partial sums are summed again
+    whenever they outgrow a chunk, so memory holds one chunk plus the running
+    aggregate. Processors whose own aggregations are sums over (a subset of)
+    these dimensions give the same result on the combined frame as on the
+    whole sheet.
 
-    df_merged = pd.merge(df_recent, rkdc_spend[['a_typ', 'row_number']], how='left', on='a_typ')
-    
-    # Group low-ranking activities as 'others'
-    df_merged.loc[df_merged["row_number"] >= 10, 'a_typ'] = 'others'
-    
-    # Calculate net consumption and re-aggregate
-    if 'backdiamond' in df_merged.columns:
-        df_merged['totaldiamond'] = df_merged['totaldiamond'] - df_merged['backdiamond']
-    
-    df_processed = df_merged.groupby(['day', 'date', 'a_typ']).agg({'totaldiamond': "sum", 'paiddiamond': "sum"}).reset_index()
-    
-    return df_processed
+    Args:
+        chunks: A loader.SheetChunks.
+        dims: Key columns kept as they are. Text columns are always kept as
+            keys; every other numeric column is summed.
+
+    Returns:
+        The combined frame, in the sheet's column order, limited to the
+        chunks' window, with categorical key columns restored.
+    """
+    partials, rows = [], 0
+    columns = None
+    for chunk in chunks:
+        if columns is None:
+            columns = list(chunk.columns)
+            categories = [col for col in columns if isinstance(chunk[col].dtype, pd.CategoricalDtype)]
+            keys = [col for col in columns if col in dims or not pd.api.types.is_numeric_dtype(chunk[col])]
+            values = [col for col in columns if col not in keys]
+            max_rows = loader.chunk_rows_for_budget(len(columns))
+        partials.append(_sum_by(chunk, keys, values))
+        rows += len(partials[-1])
+        if rows > max_rows:
+            partials = [_sum_by(pd.concat(partials, ignore_index=True), keys, values)]
+            if chunks.window is not None:
+                partials[0] = partials[0][chunks.window.select(partials[0][chunks.window.column])]
+            rows = len(partials[0])
+    if columns is None:
+        return pd.DataFrame()
+
+    df = _sum_by(pd.concat(partials, ignore_index=True), keys, values)[columns] if len(partials) > 1 \
+        else partials[0][columns]
+    if chunks.window is not None:
+        df = df[chunks.window.select(df[chunks.window.column])]
+    return df.astype({col: 'category' for col in categories}).reset_index(drop=True)
+
+def _as_frame(df, dims: list) -> pd.DataFrame:
+    """Combine a chunked sheet (see combine_chunks); whole frames pass through."""
+    return df if isinstance(df, pd.DataFrame) else combine_chunks(df, dims)
+
+@instrument.timed('process')
+def bucket_top_n(df: pd.DataFrame, key: str, rank_by, n: int, group_cols: list, values: list,
+                 other_label='others') -> pd.DataFrame:
+    """
+    Keep the `n` largest keys and lump all other keys into one 'others' bucket.
+
+    Keys are ranked by their total `rank_by`, ties broken in key order. The
+    key column is recoded through its categorical codes instead of merging
+    the ranking back onto the data, and the result is re-aggregated in the
+    same groupby.
+
+    Args:
+        df: Input data.
+        key: Column holding the keys to rank (e.g. 'affcode').
+        rank_by: Column name, or a Series aligned with `df`, to rank keys by.
+        n: Number of keys kept as they are.
+        group_cols: Columns of the re-aggregation; must include `key`.
+        values: Columns summed in the re-aggregation.
+        other_label: Label of the bucket holding the remaining keys.
+
+    Returns:
+        `group_cols` + `values`, one row per group, with `key` as a categorical.
+    """
+    keys = df[key]
+    if not isinstance(keys.dtype, pd.CategoricalDtype):
+        keys = keys.astype('category')
+    categories = keys.cat.categories
+    codes = keys.cat.codes.to_numpy()
+    weights = df[rank_by] if isinstance(rank_by, str) else rank_by
+    weights = np.nan_to_num(weights.to_numpy(dtype='float64'))
 
+    # Total per key in a single pass; keys absent from the data never rank
+    present = codes >= 0
+    totals = np.bincount(codes[present], weights=weights[present], minlength=len(categories))
+    counts = np.bincount(codes[present], minlength=len(categories))
+    totals[counts == 0] = -np.inf
+    order = np.lexsort((np.arange(len(categories)), -totals))
+    kept = np.sort(order[:min(n, int((counts > 0).sum()))])
+
+    # Recode: kept keys keep their label, every other key maps to other_label
+    labels = list(categories[kept])
+    if other_label not in labels:
+        labels.append(other_label)
+    try:
+        labels = sorted(labels)
+    except TypeError:
+        pass
+    remap = np.full(len(categories), labels.index(other_label), dtype=codes.dtype)
+    remap[kept] = [labels.index(label) for label in categories[kept]]
+    new_codes = np.where(present, remap[codes], -1)
+    bucketed = pd.Categorical.from_codes(new_codes, categories=labels)
+
+    columns = [col for col in group_cols if col != key] + list(values)
+    df_bucketed = df[columns].assign(**{key: bucketed})
+    return df_bucketed.groupby(group_cols, observed=True)[list(values)].sum().reset_index()
+
+@instrument.timed('process')
+def process_kpi_channel_data(df: pd.DataFrame, weeks=6) -> pd.DataFrame:
+    """Process the latest `weeks` weeks of KPI CHANNEL data, ranking and grouping channels by WAU."""
+    df = _as_frame(df, dims=['weekid', 'week', 'md', 'affcode'])
+    df_recent = df[df['weekid'] > (max(df['weekid']) - weeks)]
+
+    # Keep the top 9 affcode by WAU, group the rest as 'others' and re-aggregate by week and md
+    return bucket_top_n(df_recent, key='affcode', rank_by='wau', n=9,
+                        group_cols=['week', 'md', 'affcode'], values=['wau', 'wnu'])
+
+@instrument.timed('process')
+def process_cur_spend_data(df: pd.DataFrame, days=90) -> pd.DataFrame:
+    """Process the latest `days` days of currency consumption data, ranking and grouping consumption activities."""
+    df = _as_frame(df, dims=['day', 'a_typ'])
+    df = timeindex.set_time_index(df, 'day')
+    df_recent = timeindex.last_days(df, days).copy()
+    df_recent['date'] = df_recent.index
+
+    # Consumption activities (a_typ) are ranked by gross consumption
+    gross_diamond = df_recent['totaldiamond']
+
+    # Calculate net consumption
+    if 'backdiamond' in df_recent.columns:
+        df_recent['totaldiamond'] = df_recent['totaldiamond'] - df_recent['backdiamond']
+
+    # Keep the top 9 activities, group the rest as 'others' and re-aggregate by day
+    return bucket_top_n(df_recent, key='a_typ', rank_by=gross_diamond, n=9,
+                        group_cols=['day', 'date', 'a_typ'], values=['totaldiamond', 'paiddiamond'])
+
+@instrument.timed('process')
 def process_activity_data(df: pd.DataFrame, date_col='day', date_format='%Y%m%d') -> pd.DataFrame:
     """Generic activity data processing, adding ranking and mapping VIP types."""
-    df['date'] = pd.to_datetime(df[date_col], format=date_format)
-    df_sorted = df.sort_values(by='date', ascending=False)
-    df_sorted['row_number'] = df_sorted['date'].rank(ascending=False, method='dense')
+    df = _as_frame(df, dims=[date_col, 'zonetype', 'viptype'])
+    df = timeindex.set_time_index(df, date_col, date_format)
+    df_sorted = df.iloc[::-1].copy()
+    df_sorted['date'] = df_sorted.index
+
+    # Dense rank of the date, newest first; the index is already sorted. Blank days (NaT) stay unranked
+    dates = df_sorted.index.to_numpy()
+    valid = ~pd.isna(dates)
+    _, date_codes = np.unique(dates[valid], return_inverse=True)
+    row_number = np.full(len(dates), np.nan)
+    row_number[valid] = date_codes.max(initial=-1) + 1 - date_codes
+    df_sorted['row_number'] = row_number
     
     df_filtered = df_sorted[df_sorted['zonetype'] != 'Potential Internal User'].copy()
     
-    # Use mappings from config
-    df_filtered['viptype_code'] = df_filtered['viptype'].map(config.VIP_TYPE_MAPPING)
+    # Use mappings from config; mapping a categorical yields a categorical, but the codes are plotted as numbers
+    viptype_code = df_filtered['viptype'].map(config.VIP_TYPE_MAPPING)
+    df_filtered['viptype_code'] = pd.to_numeric(viptype_code.astype(object))
     
     return df_filtered
+
+@instrument.timed('process')
+def build_cube(df: pd.DataFrame, dims: list, values: list, coords: dict = None):
+    """
+    Aggregate `values` into dense arrays over every combination of `dims`.
+
+    One groupby produces the sums, which are then laid out on the full grid of
+    coordinates, so plotting loops can index cells directly instead of
+    filtering the frame for each one.
+
+    Args:
+        df: Input data.
+        dims: Dimension columns, e.g. ['date', 'zonetype', 'viptype_code'].
+        values: Columns to sum.
+        coords: Optional fixed coordinates per dimension (e.g. a display
+            order). Other dimensions use their sorted observed values.
+
+    Returns:
+        (cube, coords): `cube` maps each value column to an ndarray shaped
+        (len(coords[dim]) for dim in dims), NaN where the data has no row;
+        `coords` maps each dimension to its coordinate Index.
+    """
+    coords = dict(coords or {})
+    grouped = df.groupby(dims, observed=True)[list(values)].sum()
+    for level, dim in enumerate(dims):
+        if dim in coords:
+            coords[dim] = pd.Index(coords[dim])
+        else:
+            coords[dim] = pd.Index(grouped.index.get_level_values(level).unique()).sort_values()
+
+    shape = tuple(len(coords[dim]) for dim in dims)
+    grid = pd.MultiIndex.from_product([coords[dim] for dim in dims], names=dims)
+    dense = grouped.reindex(grid)
+    cube = {value: dense[value].to_numpy(dtype='float64').reshape(shape) for value in values}
+    return cube, coords
@@ -0,0 +1,434 @@
+# runner.py
+import cProfile
+import importlib
+import io
+import json
+import pstats
+import time
+import traceback
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from . import context, loader
+from .pipeline import Pipeline, print_waits
+from .manifest import Manifest, chart_fingerprint
+from ..modules import MODULE_NAMES
+from ..utils import instrument, plotting
+
+
+def get_module(module_name: str):
+    """Import a report module by its short name (e.g. 'kpi')."""
+    return importlib.import_module(f'..modules.{module_name}', __package__)
+
+
+def get_chart(chart_id: str) -> dict:
+    """Return the registry entry of a chart id such as 'kpi.channel'."""
+    module_name, chart_name = chart_id.split('.', 1)
+    return get_module(module_name).CHARTS[chart_name]
+
+
+def resolve_chart(chart_id: str) -> dict:
+    """
+    The registry entry of a chart with the run's CHART_RANGES applied.
+
+    A chart's 'range' is the number of latest periods it shows (days, weeks
+    or activity rounds) and is passed to its plot function as `periods`.
+    Overriding the range also grows the chart's window to cover it, so
+    streamed and history reads fetch every period shown.
+
+    Raises:
+        ValueError: If a range is set for a chart that has none.
+    """
+    chart = get_chart(chart_id)
+    periods = context.current().chart_ranges.get(chart_id)
+    if periods is None or periods == chart.get('range'):
+        return chart
+    if 'range' not in chart:
+        raise ValueError(f"Chart '{chart_id}' has no configurable range")
+    chart = dict(chart, range=periods)
+    window = chart.get('window')
+    if window is not None and periods > window.last:
+        chart['window'] = loader.RowWindow(window.column, periods, unit=window.unit)
+    return chart
+
+
+def list_charts(module_names=None) -> list:
+    """Return the ids of all charts of the given modules, in generation order."""
+    chart_ids = []
+    for module_name in module_names or MODULE_NAMES:
+        chart_ids.extend(f'{module_name}.{name}' for name in get_module(module_name).CHARTS)
+    return chart_ids
+
+
+def select_charts(selection=None) -> list:
+    """
+    Resolve a selection of chart ids and module names to chart ids.
+
+    Only the modules named in the selection are imported.
+
+    Args:
+        selection: Items such as 'kpi.channel' or 'activities'. None or
+            empty selects every chart.
+
+    Returns:
+        The selected chart ids, in generation order.
+
+    Raises:
+        ValueError: If an item names no known module or chart.
+    """
+    if not selection:
+        return list_charts()
+    selected = set()
+    for item in selection:
+        module_name, _, chart_name = item.partition('.')
+        if module_name not in MODULE_NAMES:
+            raise ValueError(f"Unknown module '{module_name}'. Available: {', '.join(MODULE_NAMES)}")
+        charts = list_charts([module_name])
+        if chart_name and item not in charts:
+            raise ValueError(f"Unknown chart '{item}'. Available: {', '.join(charts)}")
+        selected.update([item] if chart_name else charts)
+    modules = [name for name in MODULE_NAMES if any(c.split('.', 1)[0] == name for c in selected)]
+    return [chart_id for chart_id in list_charts(modules) if chart_id in selected]
+
+
+def required_sheets(chart_ids) -> list:
+    """Return the sheets the given charts read, without duplicates."""
+    return list(dict.fromkeys(get_chart(chart_id)['sheet'] for chart_id in chart_ids))
+
+
+def load_chart(chart_id: str):
+    """
+    Load the sheet of one chart: a frame, or in bounded-memory mode
+    (MEMORY_BUDGET_MB) lazily read chunks for charts marked 'chunked'.
+
+    Returns:
+        The data to hand to the chart's plot function, or None if the sheet
+        could not be loaded.
+    """
+    chart = resolve_chart(chart_id)
+    if context.current().memory_budget_mb and chart.get('chunked'):
+        return loader.load_chunks(chart['sheet'], usecols=chart.get('usecols'), window=chart.get('window'))
+    return loader.load_sheet(chart['sheet'], usecols=chart.get('usecols'), window=chart.get('window'))
+
+
+def draw_chart(chart_id: str, data):
+    """Draw a chart from its loaded sheet, showing the run's range of periods."""
+    chart = resolve_chart(chart_id)
+    chart['plot'](data, **({'periods': chart['range']} if 'range' in chart else {}))
+
+
+def generate_module(module_name: str):
+    """
+    Load and draw every chart of a report module in the active run, with the
+    run's chart ranges; backs each module's generate_all().
+
+    Unlike run_charts(), the manifest is not consulted and errors are raised.
+    Images may still be encoding on return; see plotting.flush_outputs().
+    """
+    for chart_id in list_charts([module_name]):
+        print(f"\n-- Generating {chart_id} --")
+        data = load_chart(chart_id)
+        if data is not None:
+            draw_chart(chart_id, data)
+
+
+def run_chart(chart_id: str, flush=False, run=None, loaded=None) -> dict:
+    """
+    Load the sheet of one chart and render it.
+
+    Errors are caught so a failing chart does not stop the run.
+
+    Args:
+        chart_id: Chart id such as 'kpi.channel'.
+        flush: Wait for the chart's images to be written before returning.
+            Otherwise they may still be encoding; see `apply_writes`.
+        run: RunContext to render in. Defaults to the active one.
+        loaded: A (data, stages) pair the pipeline already loaded (see
+            core.pipeline); the chart then only renders, and the loading
+            stages are reported with its own.
+
+    Returns:
+        A status dict with the chart id, 'ok' or 'failed', elapsed seconds,
+        the error message if any, the paths of the saved images, the timed
+        stages (see utils.instrument) and, once flushed, the image write records.
+    """
+    if run is not None:
+        with context.use(run):
+            return run_chart(chart_id, flush, loaded=loaded)
+    run = context.current()
+    start_time = time.time()
+    status = {'chart': chart_id, 'status': 'ok', 'seconds': 0.0, 'error': None, 'outputs': [], 'images': [],
+              'stages': []}
+    plotting.collect_saved_paths()
+    instrument.collect_stages()
+    print(f"\n-- Generating {chart_id}{f' ({run.label})' if run.label else ''} --")
+    profiler = cProfile.Profile() if chart_id in run.profile_charts else None
+    if profiler:
+        profiler.enable()
+    try:
+        chart = resolve_chart(chart_id)
+        df = load_chart(chart_id) if loaded is None else loaded[0]
+        if df is None:
+            status['status'] = 'failed'
+            status['error'] = f"Sheet '{chart['sheet']}' could not be loaded"
+        else:
+            with instrument.stage('build'):
+                draw_chart(chart_id, df)
+    except Exception as e:
+        traceback.print_exc()
+        status['status'] = 'failed'
+        status['error'] = f'{type(e).__name__}: {e}'
+    if profiler:
+        profiler.disable()
+        _save_profile(chart_id, profiler)
+    status['outputs'] = [str(path) for path in plotting.collect_saved_paths()]
+    status['stages'] = (loaded[1] if loaded is not None else []) + instrument.collect_stages()
+    if flush:
+        apply_writes([status], plotting.flush_outputs())
+    status['seconds'] = time.time() - start_time
+    return status
+
+
+def _save_profile(chart_id: str, profiler: cProfile.Profile):
+    """Write a chart's cProfile stats next to the images and print the top entries."""
+    path = context.current().output_dir / 'profiles' / f'{chart_id}.prof'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(path)
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(20)
+    print(stream.getvalue())
+    print(f"Profile of {chart_id} saved to {path}")
+
+
+def apply_writes(results, records):
+    """
+    Attach image write records to the status dicts of the charts that saved
+    them. A chart whose image failed to write is marked as failed and the
+    failed image is dropped from its outputs.
+    """
+    by_path = {record['path']: record for record in records}
+    for status in results:
+        images = [by_path[path] for path in status['outputs'] if path in by_path]
+        status['images'].extend(images)
+        errors = [record for record in images if record['error']]
+        if errors:
+            status['status'] = 'failed'
+            status['error'] = status['error'] or f"Could not write {errors[0]['path']}: {errors[0]['error']}"
+            failed = {record['path'] for record in errors}
+            status['outputs'] = [path for path in status['outputs'] if path not in failed]
+
+
+def _init_worker():
+    """Apply the chart style in every worker process; settings arrive with each chart's run context."""
+    plotting.setup_matplotlib_style()
+
+
+def _fingerprint(chart_id: str) -> str | None:
+    """Fingerprint of a chart, or None if its sheet cannot be hashed."""
+    chart = resolve_chart(chart_id)
+    try:
+        sheet_digest = loader.get_session().sheet_digest(chart['sheet'])
+    except OSError:
+        return None
+    return chart_fingerprint(chart_id, chart, sheet_digest)
+
+
+def _skipped(chart_id: str) -> dict:
+    return {'chart': chart_id, 'status': 'skipped', 'seconds': 0.0, 'error': None, 'outputs': [], 'images': [],
+            'stages': []}
+
+
+def run_charts(chart_ids, jobs=1, force=False) -> list:
+    """
+    Render the charts whose inputs changed since the last run.
+
+    A chart is skipped when the manifest in the output directory records the
+    same fingerprint (sheet data, code version and style) and its images
+    still exist. Skipped charts are neither loaded, processed nor rendered.
+
+    Args:
+        chart_ids: Chart ids to render.
+        jobs: Number of worker processes. 1 renders sequentially in-process.
+        force: Render every chart regardless of the manifest.
+
+    Returns:
+        The status dicts of all charts, in the order of `chart_ids`.
+    """
+    return run_batch([context.current()], chart_ids, jobs=jobs, force=force)[0]
+
+
+def run_batch(runs, chart_ids, jobs=1, force=False) -> list:
+    """
+    Render the same charts for several workbooks, sharing one worker pool.
+
+    Each run context reads its own workbook and keeps its own manifest in its
+    output directory, so unchanged charts are skipped per workbook (see
+    run_charts). The stale charts of all workbooks are then rendered
+    together, so the pool stays busy across workbooks.
+
+    Args:
+        runs: RunContexts, one per workbook.
+        chart_ids: Chart ids to render for every workbook.
+        jobs: Number of worker processes. 1 renders sequentially in-process.
+        force: Render every chart regardless of the manifests.
+
+    Returns:
+        One list of status dicts per run, each in the order of `chart_ids`.
+    """
+    manifests, fingerprints, results, tasks = [], [], [], []
+    for index, run in enumerate(runs):
+        with context.use(run):
+            manifests.append(Manifest())
+            try:
+                # Hash only the sheets these charts read, in a single pass
+                loader.get_session().sheet_digests(required_sheets(chart_ids))
+            except OSError:
+                pass
+            fingerprints.append({chart_id: _fingerprint(chart_id) for chart_id in chart_ids})
+        # Profiled charts always run
+        skipped = {chart_id: _skipped(chart_id) for chart_id, fingerprint in fingerprints[index].items()
+                   if not force and fingerprint and manifests[index].is_current(chart_id, fingerprint)
+                   and chart_id not in run.profile_charts}
+        results.append(skipped)
+        tasks.extend((index, chart_id) for chart_id in chart_ids if chart_id not in skipped)
+        if skipped:
+            print(f"Skipping {len(skipped)} chart(s){f' of {run.label}' if run.label else ''} "
+                  "whose inputs are unchanged.")
+
+    for (index, chart_id), result in zip(tasks, _render(runs, tasks, jobs)):
+        results[index][chart_id] = result
+        fingerprint = fingerprints[index][chart_id]
+        if result['status'] == 'ok' and fingerprint:
+            manifests[index].record(chart_id, fingerprint, result['outputs'])
+        else:
+            manifests[index].discard(chart_id)
+    for manifest in manifests:
+        manifest.save()
+    return [[run_results[chart_id] for chart_id in chart_ids] for run_results in results]
+
+
+def _prefetch(run, chart_ids):
+    """Parse the sheets of a run's charts in parallel before they render in this process."""
+    with context.use(run):
+        requests = []
+        for chart in map(resolve_chart, chart_ids):
+            # Chunked charts read their sheet piece by piece instead
+            if not (run.memory_budget_mb and chart.get('chunked')):
+                requests.append((chart['sheet'], chart.get('usecols'), chart.get('window')))
+        loader.prefetch(requests, run.prefetch_jobs)
+
+
+def _render_pipelined(runs, tasks) -> list:
+    """Render in this process while a loader thread loads the sheets of the next charts."""
+    first_tasks = {}
+    for task in tasks:
+        first_tasks.setdefault(task[0], task)
+
+    def load(task):
+        index, chart_id = task
+        run = runs[index]
+        with context.use(run):
+            if run.prefetch_jobs > 1 and first_tasks[index] == task:
+                _prefetch(run, [task_chart for task_index, task_chart in tasks if task_index == index])
+            try:
+                return load_chart(chart_id)
+            except Exception:
+                traceback.print_exc()
+                return None
+
+    # A new workbook's session replaces the previous one, so runs are not loaded ahead across workbooks
+    results = [run_chart(chart_id, run=runs[index], loaded=(data, stages))
+               for (index, chart_id), data, stages in Pipeline(tasks, load, group=lambda task: task[0])]
+    apply_writes(results, plotting.flush_outputs())
+    print_waits(results)
+    return results
+
+
+def _render(runs, tasks, jobs) -> list:
+    """Render (run index, chart id) tasks, either in this process or across a process pool."""
+    if (jobs <= 1 or len(tasks) <= 1) and all(run.pipeline for run in runs):
+        return _render_pipelined(runs, tasks)
+    if jobs <= 1 or len(tasks) <= 1:
+        results = []
+        for position, (index, chart_id) in enumerate(tasks):
+            # Tasks are grouped by run; prefetch a run's sheets before its first chart
+            if runs[index].prefetch_jobs > 1 and (position == 0 or tasks[position - 1][0] != index):
+                _prefetch(runs[index], [task_chart for task_index, task_chart in tasks if task_index == index])
+            # Images keep encoding in the background while the next chart is drawn
+            results.append(run_chart(chart_id, run=runs[index]))
+        apply_writes(results, plotting.flush_outputs())
+        return results
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) as pool:
+        # Worker processes may exit before their writer threads, so each chart flushes
+        futures = {pool.submit(run_chart, chart_id, True, runs[index]): (index, chart_id)
+                   for index, chart_id in tasks}
+        for done, future in enumerate(as_completed(futures), 1):
+            index, chart_id = futures[future]
+            try:
+                results[index, chart_id] = future.result()
+            except Exception as e:
+                # The worker itself died (e.g. killed or out of memory)
+                results[index, chart_id] = {'chart': chart_id, 'status': 'failed', 'seconds': 0.0,
+                                            'error': f'{type(e).__name__}: {e}', 'outputs': [], 'images': [],
+                                            'stages': []}
+            if len(runs) > 1:
+                print(f"[{done}/{len(tasks)}] {runs[index].label} {chart_id}: {results[index, chart_id]['status']}")
+    return [results[task] for task in tasks]
+
+
+def print_summary(results, heading='Chart Status Summary'):
+    """Print a per-chart status table."""
+    print(f"\n--- {heading} ---")
+    for result in results:
+        line = f"  [{result['status'].upper():>7}] {result['chart']:<28} {result['seconds']:6.2f}s"
+        if result['error']:
+            line += f"  {result['error']}"
+        print(line)
+    counts = {status: sum(result['status'] == status for result in results)
+              for status in ('ok', 'skipped', 'failed')}
+    print(f"  {counts['ok']} rendered, {counts['skipped']} unchanged, {counts['failed']} failed.")
+
+    images = [record for result in results for record in result.get('images', []) if not record['error']]
+    if images:
+        total_mb = sum(record['bytes'] for record in images) / 1024 ** 2
+        encode_seconds = sum(record['seconds'] for record in images)
+        print(f"  {len(images)} image(s) written ({context.current().output_format}), {total_mb:.1f} MB, "
+              f"{encode_seconds:.2f}s encoding.")
+
+
+def write_run_report(results, seconds: float, jobs=1):
+    """
+    Write a JSON report of the run next to the images (<output_dir>/run_report.json).
+
+    Every chart gets its status, its timed stages and per-stage totals
+    (load, process, build, layout, save and the background image encode),
+    so regressions can be traced to a chart and a stage. `seconds` is the
+    wall time of the whole run; in a batch, of the whole batch.
+    """
+    run = context.current()
+    charts = []
+    for result in results:
+        summary = instrument.summarize(result.get('stages', []))
+        images = [record for record in result.get('images', []) if not record['error']]
+        if images:
+            summary['encode'] = {'wall': sum(record['seconds'] for record in images), 'cpu': None,
+                                 'peak_mb': None, 'calls': len(images)}
+        charts.append({
+            'chart': result['chart'], 'status': result['status'], 'seconds': result['seconds'],
+            'error': result['error'], 'summary': summary, 'stages': result.get('stages', []),
+            'images': result.get('images', []),
+        })
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'input_file': str(run.input_file),
+        'seconds': seconds,
+        'jobs': jobs,
+        'settings': run.settings(),
+        'charts': charts,
+    }
+    path = run.output_dir / 'run_report.json'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=2, ensure_ascii=False, default=str))
+    print(f"Run report saved to {path}")
+    return path
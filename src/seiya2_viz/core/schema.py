@@ -0,0 +1,149 @@
+# schema.py
+import numpy as np
+import pandas as pd
+
+# ODPS writes SQL NULL as '\N'
+DEFAULT_NULL_TOKENS = [r'\N']
+
+# User counts fit comfortably in 32 bits
+_COUNTS = 'int32'
+_RATIO = 'float32'
+
+# -----------------
+# Per-sheet schemas
+# -----------------
+# dtypes:     compact numeric dtype of each known column
+# categories: string key columns, parsed straight into pandas categoricals
+# dates:      yyyymmdd date columns (stored as int32)
+# nulls:      columns known to carry ODPS null tokens; replaced with 0
+# null_tokens: tokens treated as null in this sheet (defaults to '\N')
+#
+# Columns a schema does not mention are cleaned as before. Numeric columns
+# that still come back as text are cleaned defensively, so a stray null in
+# an undeclared column never breaks the cast.
+_ACTIVITY_SCHEMA = {
+    'dtypes': {'au': _COUNTS, 'pu': _COUNTS, 'cu': _COUNTS,
+               'freediamond': 'int64', 'paiddiamond': 'int64', 'backdiamond': 'int64'},
+    'categories': ['zonetype', 'viptype', 'card_id', 'card_name'],
+    'dates': ['day'],
+    'nulls': ['backdiamond', 'sales'],
+}
+
+SHEET_SCHEMAS = {
+    'KPI_WKLY': {
+        'dtypes': {'weekid': _COUNTS, 'wou': _COUNTS, 'wnu': _COUNTS, 'wau': _COUNTS},
+        'dates': ['week'],
+    },
+    'KPI_DAILY': {
+        'dtypes': {'dou': _COUNTS, 'dnu': _COUNTS, 'dau': _COUNTS,
+                   'arpu': _RATIO, 'arppu': _RATIO, 'payrate': _RATIO},
+        'dates': ['day'],
+        'nulls': ['arpu', 'arppu', 'payrate'],
+    },
+    'KPI_CHANNEL': {
+        'dtypes': {'weekid': _COUNTS, 'wau': _COUNTS, 'wnu': _COUNTS},
+        'categories': ['affcode'],
+        'dates': ['week'],
+    },
+    'KPI_USER': {
+        'dtypes': {'weekid': _COUNTS, 'wau': _COUNTS},
+        'dates': ['week'],
+        'nulls': ['wsales'],
+    },
+    'CUR_SPEND': {
+        'dtypes': {'totaldiamond': 'int64', 'paiddiamond': 'int64', 'backdiamond': 'int64'},
+        'categories': ['a_typ'],
+        'dates': ['day'],
+        'nulls': ['backdiamond'],
+    },
+    'CUR_STOCK': {
+        'dtypes': {f'v{level:02d}': _COUNTS for level in range(20)},
+        'dates': ['day'],
+    },
+    'HERO_HOLD': {
+        'dtypes': {'core': 'int8', 'hu_tw': _COUNTS, 'hu_lw': _COUNTS},
+        'categories': ['card_name'],
+    },
+    'KPI_ZONE': {
+        'dtypes': {'wnu': _COUNTS},
+        'categories': ['zone', 'zone_type', 'user_type'],
+        'dates': ['day'],
+        'nulls': ['wsales'],
+    },
+    'SALES_INDEX': {
+        'dtypes': {'pu': _COUNTS},
+        'dates': ['day'],
+    },
+    'ACT_PRIZEWHEEL': _ACTIVITY_SCHEMA,
+    'ACT_INTERZONE_FORCECARD': _ACTIVITY_SCHEMA,
+    'ACT_SOULSTONEBOX': _ACTIVITY_SCHEMA,
+    'ACT_THEMEGACHA': _ACTIVITY_SCHEMA,
+    'ACT_WISHPOOL': _ACTIVITY_SCHEMA,
+}
+
+
+def get_schema(sheet_name: str) -> dict | None:
+    """Return the registered schema of a sheet, or None if it has none."""
+    return SHEET_SCHEMAS.get(sheet_name)
+
+
+def parse_dtypes(schema: dict | None) -> dict:
+    """dtype argument for the Excel parser: declared key columns become categoricals."""
+    if not schema:
+        return {}
+    return {column: 'category' for column in schema.get('categories', [])}
+
+
+def _replace_nulls(series: pd.Series, tokens) -> pd.Series:
+    return series.replace(tokens, 0).infer_objects()
+
+
+def _fits(series: pd.Series, dtype: str) -> bool:
+    """True if every value of a numeric series lies within the range of dtype."""
+    if series.empty:
+        return True
+    dtype = np.dtype(dtype)
+    limits = np.iinfo(dtype) if dtype.kind in 'iu' else np.finfo(dtype)
+    return limits.min <= series.min() and series.max() <= limits.max
+
+
+def _cast(series: pd.Series, dtype: str) -> pd.Series:
+    """Cast to a compact dtype; columns holding NaN or values out of its range keep pandas' default."""
+    try:
+        series = pd.to_numeric(series)
+        if series.isna().any() or not _fits(series, dtype):
+            return series
+        return series.astype(dtype)
+    except (ValueError, TypeError):
+        return series
+
+
+def apply_schema(df: pd.DataFrame, schema: dict | None) -> pd.DataFrame:
+    """
+    Clean a freshly parsed sheet according to its schema.
+
+    Null tokens are replaced only in the declared null columns and in columns
+    that came back as text; numeric and key columns are left untouched. Known
+    numeric columns are then cast to their compact dtypes.
+
+    Sheets without a schema get the original whole-frame replacement.
+    """
+    if schema is None:
+        return df.replace(DEFAULT_NULL_TOKENS, 0).infer_objects()
+
+    tokens = schema.get('null_tokens', DEFAULT_NULL_TOKENS)
+    keys = set(schema.get('categories', []))
+    dtypes = dict(schema.get('dtypes', {}))
+    dtypes.update({column: 'int32' for column in schema.get('dates', [])})
+    nulls = set(schema.get('nulls', []))
+
+    for column in df.columns:
+        if column in keys:
+            continue
+        series = df[column]
+        if column in nulls or series.dtype == object or pd.api.types.is_string_dtype(series.dtype):
+            series = _replace_nulls(series, tokens)
+        if column in dtypes:
+            series = _cast(series, dtypes[column])
+        df[column] = series
+    return df
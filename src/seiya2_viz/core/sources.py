@@ -0,0 +1,397 @@
+# sources.py
+import hashlib
+import sqlite3
+from abc import ABC, abstractmethod
+from contextlib import closing
+from pathlib import Path
+import pandas as pd
+from .. import config
+from .cache import HAS_PYARROW, file_digest, xlsx_sheet_digests
+
+EXCEL_SUFFIXES = ('.xlsx', '.xlsm')
+SQLITE_SUFFIXES = ('.sqlite', '.sqlite3', '.db')
+DELIMITED_SUFFIXES = {'.csv': ',', '.tsv': '\t'}
+
+
+def resolve_usecols(header, usecols) -> list:
+    """Return the column positions selected by a `usecols` argument."""
+    if usecols is None:
+        return list(range(len(header)))
+    if isinstance(usecols, str):
+        from openpyxl.utils import range_boundaries
+        positions = []
+        for part in usecols.split(','):
+            part = part.strip()
+            min_col, _, max_col, _ = range_boundaries(part if ':' in part else f'{part}:{part}')
+            positions.extend(range(min_col - 1, max_col))
+        return sorted(set(positions))
+    if callable(usecols):
+        return [i for i, name in enumerate(header) if usecols(name)]
+    usecols = list(usecols)
+    if all(isinstance(col, int) for col in usecols):
+        return sorted(usecols)
+    return [i for i, name in enumerate(header) if name in usecols]
+
+
+def _restore_numbers(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Turn numeric strings in text columns back into numbers.
+
+    Text formats cannot hold a column mixing numbers and labels (e.g. the
+    SALES_INDEX 'index' or a count column holding '\\N'), so such columns come
+    back as strings. An Excel cell keeps its number, and the cleaning and
+    charts rely on that.
+    """
+    for column in df.columns:
+        series = df[column]
+        if isinstance(series.dtype, pd.CategoricalDtype) or not (
+                series.dtype == object or pd.api.types.is_string_dtype(series.dtype)):
+            continue
+        numbers = pd.to_numeric(series, errors='coerce')
+        found = numbers.notna() & series.notna()
+        if not found.any():
+            continue
+        values = numbers[found]
+        if (values % 1 == 0).all():
+            values = values.astype('int64')
+        series = series.astype(object)
+        series[found] = values.astype(object)
+        df[column] = series
+    return df
+
+
+class Source(ABC):
+    """
+    Where the sheets of a report are read from.
+
+    A source hands out raw sheets, one DataFrame per sheet name, with the
+    columns of the original ODPS query output. Null tokens are not cleaned:
+    WorkbookSession cleans every source's frames the same way, so modules
+    work unchanged on any source.
+
+    Args:
+        path: The file or directory holding the sheets.
+    """
+
+    kind = None
+    # Whether rows() can stream a sheet row by row (used by --stream)
+    streams_rows = False
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def fingerprint(self) -> str:
+        """Content hash of the whole source."""
+        return file_digest(self.path)
+
+    def sheet_digests(self, sheet_names) -> dict:
+        """Content hashes of single sheets; sheets left out fall back to the fingerprint."""
+        return {}
+
+    @abstractmethod
+    def read(self, sheet_name: str, usecols=None, dtype=None) -> pd.DataFrame:
+        """
+        Read one sheet.
+
+        Args:
+            sheet_name: Name of the sheet.
+            usecols: Columns to read, as accepted by pd.read_excel.
+            dtype: dtypes of known columns (see schema.parse_dtypes).
+
+        Raises:
+            FileNotFoundError: If the source does not exist.
+            ValueError: If the source has no such sheet.
+        """
+
+    def columns(self, sheet_name: str) -> list:
+        """Column names of a sheet."""
+        return list(self.read(sheet_name).columns)
+
+    def read_chunks(self, sheet_name: str, usecols=None, dtype=None, chunk_rows=100_000):
+        """Yield a sheet as frames of at most `chunk_rows` rows."""
+        df = self.read(sheet_name, usecols=usecols, dtype=dtype)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+
+    def close(self):
+        pass
+
+    def _missing(self, sheet_name: str):
+        return ValueError(f"Worksheet named '{sheet_name}' not found in {self.kind} source '{self.path}'")
+
+
+class ExcelSource(Source):
+    """An .xlsx workbook with one worksheet per sheet."""
+
+    kind = 'excel'
+    streams_rows = True
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._book = None
+        self._stream_book = None
+
+    def sheet_digests(self, sheet_names) -> dict:
+        return xlsx_sheet_digests(self.path, sheets=sheet_names)
+
+    def read(self, sheet_name: str, usecols=None, dtype=None) -> pd.DataFrame:
+        if self._book is None:
+            self._book = pd.ExcelFile(self.path)
+        return self._book.parse(sheet_name, usecols=usecols, dtype=dtype)
+
+    def rows(self, sheet_name: str):
+        """Return the header and an iterator over the raw rows of a sheet, via openpyxl's read-only mode."""
+        if self._stream_book is None:
+            from openpyxl import load_workbook
+            self._stream_book = load_workbook(self.path, read_only=True, data_only=True)
+        if sheet_name not in self._stream_book.sheetnames:
+            raise ValueError(f"Worksheet named '{sheet_name}' not found")
+        rows = self._stream_book[sheet_name].iter_rows(values_only=True)
+        return next(rows, ()), rows
+
+    def close(self):
+        if self._book is not None:
+            self._book.close()
+            self._book = None
+        if self._stream_book is not None:
+            self._stream_book.close()
+            self._stream_book = None
+
+
+class _DirectorySource(Source):
+    """A directory holding one file per sheet, named after the sheet."""
+
+    suffixes = ()
+
+    def _file(self, sheet_name: str) -> Path:
+        if not self.path.is_dir():
+            raise FileNotFoundError(f"No such directory: '{self.path}'")
+        for suffix in self.suffixes:
+            path = self.path / f'{sheet_name}{suffix}'
+            if path.exists():
+                return path
+        raise self._missing(sheet_name)
+
+    def _files(self) -> list:
+        return sorted(path for path in self.path.iterdir() if path.suffix.lower() in self.suffixes)
+
+    def fingerprint(self) -> str:
+        digest = hashlib.sha256()
+        for path in self._files():
+            digest.update(path.name.encode('utf-8'))
+            digest.update(file_digest(path).encode('ascii'))
+        return digest.hexdigest()
+
+    def sheet_digests(self, sheet_names) -> dict:
+        digests = {}
+        for sheet_name in sheet_names:
+            try:
+                digests[sheet_name] = file_digest(self._file(sheet_name))
+            except ValueError:
+                pass
+        return digests
+
+
+class DelimitedSource(_DirectorySource):
+    """A directory of CSV or TSV files, e.g. ODPS query output saved as <SHEET>.csv."""
+
+    kind = 'csv'
+    suffixes = tuple(DELIMITED_SUFFIXES)
+
+    def columns(self, sheet_name: str) -> list:
+        path = self._file(sheet_name)
+        return list(pd.read_csv(path, sep=DELIMITED_SUFFIXES[path.suffix.lower()], nrows=0).columns)
+
+    def _read_csv(self, sheet_name, usecols, dtype, **kwargs):
+        path = self._file(sheet_name)
+        if usecols is not None and not callable(usecols):
+            header = self.columns(sheet_name)
+            usecols = [header[i] for i in resolve_usecols(header, usecols)]
+        return pd.read_csv(path, sep=DELIMITED_SUFFIXES[path.suffix.lower()], usecols=usecols, dtype=dtype,
+                           **kwargs)
+
+    def read(self, sheet_name: str, usecols=None, dtype=None) -> pd.DataFrame:
+        return _restore_numbers(self._read_csv(sheet_name, usecols, dtype))
+
+    def read_chunks(self, sheet_name: str, usecols=None, dtype=None, chunk_rows=100_000):
+        with self._read_csv(sheet_name, usecols, dtype, chunksize=chunk_rows) as reader:
+            for df in reader:
+                yield _restore_numbers(df)
+
+
+class ParquetSource(_DirectorySource):
+    """A directory of Parquet files, one <SHEET>.parquet per sheet."""
+
+    kind = 'parquet'
+    suffixes = ('.parquet',)
+
+    def columns(self, sheet_name: str) -> list:
+        import pyarrow.parquet as pq
+        return pq.read_schema(self._file(sheet_name)).names
+
+    def _columns(self, path, usecols):
+        import pyarrow.parquet as pq
+        names = pq.read_schema(path).names
+        return [names[i] for i in resolve_usecols(names, usecols)]
+
+    @staticmethod
+    def _finish(df: pd.DataFrame, dtype) -> pd.DataFrame:
+        df = _restore_numbers(df)
+        return df.astype({column: value for column, value in (dtype or {}).items() if column in df.columns})
+
+    def read(self, sheet_name: str, usecols=None, dtype=None) -> pd.DataFrame:
+        if not HAS_PYARROW:
+            raise ImportError("Reading Parquet sources requires pyarrow")
+        path = self._file(sheet_name)
+        return self._finish(pd.read_parquet(path, columns=self._columns(path, usecols)), dtype)
+
+    def read_chunks(self, sheet_name: str, usecols=None, dtype=None, chunk_rows=100_000):
+        if not HAS_PYARROW:
+            raise ImportError("Reading Parquet sources requires pyarrow")
+        import pyarrow.parquet as pq
+        path = self._file(sheet_name)
+        with pq.ParquetFile(path) as parquet:
+            for batch in parquet.iter_batches(batch_size=chunk_rows, columns=self._columns(path, usecols)):
+                yield self._finish(batch.to_pandas(), dtype)
+
+
+class SQLiteSource(Source):
+    """A SQLite database with one table per sheet."""
+
+    kind = 'sqlite'
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._conn = None
+
+    def columns(self, sheet_name: str) -> list:
+        if self._conn is None:
+            if not self.path.exists():
+                raise FileNotFoundError(f"No such database: '{self.path}'")
+            self._conn = sqlite3.connect(self.path)
+        quoted = '"' + sheet_name.replace('"', '""') + '"'
+        names = [row[1] for row in self._conn.execute(f'PRAGMA table_info({quoted})')]
+        if not names:
+            raise self._missing(sheet_name)
+        return names
+
+    def _query(self, sheet_name: str, usecols) -> str:
+        names = self.columns(sheet_name)
+        quoted = '"' + sheet_name.replace('"', '""') + '"'
+        columns = ', '.join('"' + names[i].replace('"', '""') + '"' for i in resolve_usecols(names, usecols))
+        return f'SELECT {columns} FROM {quoted} ORDER BY rowid'
+
+    @staticmethod
+    def _finish(df: pd.DataFrame, dtype) -> pd.DataFrame:
+        return df.astype({column: value for column, value in (dtype or {}).items() if column in df.columns})
+
+    def read(self, sheet_name: str, usecols=None, dtype=None) -> pd.DataFrame:
+        query = self._query(sheet_name, usecols)
+        return self._finish(pd.read_sql_query(query, self._conn), dtype)
+
+    def read_chunks(self, sheet_name: str, usecols=None, dtype=None, chunk_rows=100_000):
+        query = self._query(sheet_name, usecols)
+        for df in pd.read_sql_query(query, self._conn, chunksize=chunk_rows):
+            yield self._finish(df, dtype)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+SOURCE_TYPES = {source.kind: source for source in (ExcelSource, DelimitedSource, ParquetSource, SQLiteSource)}
+
+
+def detect_kind(path) -> str | None:
+    """
+    Guess the kind of source at `path`: by suffix for files, by the files it
+    holds for directories. Returns None if `path` holds no known source.
+    """
+    path = Path(path)
+    if path.is_dir():
+        suffixes = {child.suffix.lower() for child in path.iterdir()}
+        if '.parquet' in suffixes:
+            return 'parquet'
+        if suffixes & set(DELIMITED_SUFFIXES):
+            return 'csv'
+        return None
+    suffix = path.suffix.lower()
+    if suffix in EXCEL_SUFFIXES:
+        return 'excel'
+    if suffix in SQLITE_SUFFIXES:
+        return 'sqlite'
+    return None
+
+
+def open_source(path, kind=None) -> Source:
+    """
+    Return the source adapter for `path`.
+
+    Args:
+        path: Workbook, database file or directory of per-sheet files.
+        kind: 'excel', 'csv', 'parquet' or 'sqlite'. Defaults to
+            config.INPUT_FORMAT, then to the kind detected from the path.
+            Paths that cannot be detected (e.g. missing files) are read as Excel.
+    """
+    kind = kind or config.INPUT_FORMAT or detect_kind(path) or 'excel'
+    if kind not in SOURCE_TYPES:
+        raise ValueError(f"Unknown source kind '{kind}'. Available: {', '.join(SOURCE_TYPES)}")
+    return SOURCE_TYPES[kind](path)
+
+
+def write_sheets(sheets: dict, path, kind: str) -> Path:
+    """
+    Write sheets (sheet name -> DataFrame) as a source of the given kind,
+    e.g. to convert a workbook to Parquet.
+
+    Text columns holding numbers as well are written as text in the CSV and
+    Parquet formats; the sources turn them back into numbers when reading.
+    """
+    path = Path(path)
+    if kind == 'excel':
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with pd.ExcelWriter(path) as writer:
+            for sheet_name, df in sheets.items():
+                df.to_excel(writer, sheet_name=sheet_name, index=False)
+    elif kind == 'sqlite':
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with sqlite3.connect(path) as conn:
+            for sheet_name, df in sheets.items():
+                # BLOB columns have no type affinity, so mixed values keep their types
+                mixed = {column: 'BLOB' for column in df.columns if df[column].dtype == object}
+                df.to_sql(sheet_name, conn, index=False, if_exists='replace', dtype=mixed)
+        conn.close()
+    elif kind in ('csv', 'parquet'):
+        path.mkdir(parents=True, exist_ok=True)
+        for sheet_name, df in sheets.items():
+            if kind == 'csv':
+                df.to_csv(path / f'{sheet_name}.csv', index=False)
+            else:
+                text = {column: df[column].where(df[column].isna(), df[column].astype(str))
+                        for column in df.columns if df[column].dtype == object}
+                df.assign(**text).to_parquet(path / f'{sheet_name}.parquet', index=False)
+    else:
+        raise ValueError(f"Unknown source kind '{kind}'. Available: {', '.join(SOURCE_TYPES)}")
+    return path
+
+
+def convert(path, dest, kind: str) -> Path:
+    """
+    Copy every sheet of a source into a source of another kind, unchanged.
+
+        python -c "from seiya2_viz.core import sources; sources.convert('in.xlsx', 'out', 'parquet')"
+    """
+    source = open_source(path)
+    try:
+        if isinstance(source, ExcelSource):
+            with pd.ExcelFile(source.path) as book:
+                sheet_names = book.sheet_names
+        elif isinstance(source, SQLiteSource):
+            with closing(sqlite3.connect(source.path)) as conn:
+                sheet_names = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        else:
+            sheet_names = [file.stem for file in source._files()]
+        return write_sheets({name: source.read(name) for name in sheet_names}, dest, kind)
+    finally:
+        source.close()
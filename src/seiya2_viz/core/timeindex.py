@@ -0,0 +1,39 @@
+# timeindex.py
+import pandas as pd
+
+
+def set_time_index(df: pd.DataFrame, column: str, date_format='%Y%m%d') -> pd.DataFrame:
+    """
+    Return the frame sorted by a date column, with the parsed dates as index.
+
+    The loader does this once per sheet, so plot functions can slice date
+    windows by binary search instead of re-parsing and scanning the column.
+    Frames already indexed by the sorted dates of `column` are returned
+    unchanged; the index is named after the column it was parsed from (not
+    the column name itself, which pandas would find ambiguous in groupby).
+    Unparseable dates become NaT and sort first, outside every window.
+
+    Args:
+        df: Input data.
+        column: yyyymmdd date column (e.g. 'day' or 'week').
+        date_format: Format of the date column.
+    """
+    name = f'{column}_parsed'
+    if isinstance(df.index, pd.DatetimeIndex) and df.index.name == name and df.index.is_monotonic_increasing:
+        return df
+    dates = pd.to_datetime(df[column], format=date_format, errors='coerce')
+    df = df.set_axis(pd.DatetimeIndex(dates.to_numpy(), name=name), axis=0)
+    return df.sort_index(kind='stable', na_position='first')
+
+
+def last_days(df: pd.DataFrame, n: int) -> pd.DataFrame:
+    """Rows dated within `n` days of the latest date, both ends inclusive."""
+    if df.empty:
+        return df
+    start = df.index[-1] - pd.Timedelta(days=n)
+    return df.iloc[df.index.searchsorted(start, side='left'):]
+
+
+def last_rows(df: pd.DataFrame, n: int) -> pd.DataFrame:
+    """The `n` most recent rows."""
+    return df.iloc[-n:]
@@ -0,0 +1,117 @@
+# watch.py
+import time
+from datetime import datetime
+from . import context, loader, runner
+
+
+def _signature(path):
+    """Modification time and size of a file, or of every file in a directory; None if it does not exist."""
+    try:
+        if path.is_dir():
+            return tuple((child.name, child.stat().st_mtime_ns, child.stat().st_size)
+                         for child in sorted(path.iterdir()))
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class Watcher:
+    """
+    Long-running mode re-rendering workbooks as new revisions are dropped.
+
+    Workbooks are polled on the filesystem. A workbook is rendered once its
+    modification time and size have not changed for one poll, so files still
+    being copied are not read. Python, matplotlib, fonts and parsed sheets
+    stay warm between cycles: every workbook keeps a session, and a new
+    revision's session takes over the parsed frames of sheets whose content
+    did not change. The manifest then skips every chart whose sheet did not
+    change.
+
+    Args:
+        find_runs: Callable returning the RunContexts to watch. It is called
+            at every poll, so workbooks that appear are picked up.
+        chart_ids: Chart ids to render.
+        interval: Seconds between polls.
+        ingest: Add each new revision to its history store before rendering.
+    """
+
+    def __init__(self, find_runs, chart_ids, interval=5.0, ingest=False):
+        self.find_runs = find_runs
+        self.chart_ids = chart_ids
+        self.interval = interval
+        self.ingest = ingest
+        self.cycles = 0
+        self._sessions = {}  # workbook path -> WorkbookSession
+        self._seen = {}  # workbook path -> signature at the previous poll
+        self._rendered = {}  # workbook path -> signature last rendered
+
+    def poll(self) -> list:
+        """Return the runs whose workbook changed since it was last rendered and is complete."""
+        ready = []
+        runs = self.find_runs()
+        for run in runs:
+            path = run.input_file
+            signature = _signature(path)
+            if signature is not None and signature == self._seen.get(path) and signature != self._rendered.get(path):
+                ready.append(run)
+            self._seen[path] = signature
+        # Forget workbooks that are gone
+        watched = {run.input_file for run in runs}
+        for path in list(self._sessions):
+            if path not in watched:
+                self._sessions.pop(path).close()
+                self._rendered.pop(path, None)
+        return ready
+
+    def render(self, run) -> list:
+        """Render one workbook's changed charts and log the cycle."""
+        start_time = time.time()
+        path = run.input_file
+        self._rendered[path] = self._seen[path]
+        self.cycles += 1
+        with context.use(run):
+            if self.ingest:
+                from .history import HistoryStore
+                try:
+                    with loader.WorkbookSession(use_history=False) as source, HistoryStore() as store:
+                        store.ingest(source)
+                except (OSError, ValueError) as e:
+                    print(f"ERROR: Could not ingest '{path}' into the history store: {e}")
+
+            session = loader.WorkbookSession()
+            previous = self._sessions.pop(path, None)
+            if previous is not None:
+                session.adopt(previous)
+                previous.close()
+            self._sessions[path] = session
+            loader.use_session(session)
+
+            results = runner.run_charts(self.chart_ids)
+            seconds = time.time() - start_time
+            runner.print_summary(results, heading=f'{run.label} Chart Status' if run.label else 'Chart Status Summary')
+            runner.write_run_report(results, seconds)
+
+        counts = {status: sum(result['status'] == status for result in results)
+                  for status in ('ok', 'skipped', 'failed')}
+        print(f"[{datetime.now():%H:%M:%S}] Cycle {self.cycles}: {path.name}: {counts['ok']} rendered, "
+              f"{counts['skipped']} unchanged, {counts['failed']} failed in {seconds:.2f}s.")
+        return results
+
+    def run_forever(self):
+        """Poll and render until interrupted (Ctrl+C)."""
+        # Workbooks present at start-up are taken as complete
+        for run in self.find_runs():
+            self._seen[run.input_file] = _signature(run.input_file)
+        print(f"Watching {len(self._seen)} workbook(s), polling every {self.interval:g}s. Press Ctrl+C to stop.")
+        try:
+            while True:
+                for run in self.poll():
+                    self.render(run)
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            print("\nStopped watching.")
+        finally:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
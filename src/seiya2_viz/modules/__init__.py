@@ -1 +1,4 @@
-# This file makes the 'plotting' directory a Python package.
\ No newline at end of file
+# This file makes the 'plotting' directory a Python package.
+
+# Report modules in the order they are generated
+MODULE_NAMES = ['kpi', 'currency', 'user_base', 'hero', 'activities']
@@ -2,34 +2,29 @@
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-import seaborn as sns
 from ..core import loader
 from .. import config
 from ..core import processors
-from ..utils.plotting import save_plot
+from ..core import metrics as derived
+from ..utils.plotting import save_plot, plot_heatmap
 
 # ----------------------------------
 # Reusable Activity Plotting Functions
 # ----------------------------------
 
-def _plot_activity_overview(df: pd.DataFrame, activity_name: str, date_col='date'):
-    """通用函数: 绘制活动概览图 (总消耗 vs 参与率)"""
+def _plot_activity_overview(df: pd.DataFrame, activity_name: str, date_col='date', periods=30):
+    """通用函数: 绘制最近periods期的活动概览图 (总消耗 vs 参与率)"""
     
     # 动态构建聚合字典
     agg_dict = {'freediamond': 'sum', 'paiddiamond': 'sum', 'au': 'sum', 'pu': 'sum'}
     if 'backdiamond' in df.columns:
         agg_dict['backdiamond'] = 'sum'
 
-    df_agg = df[df['row_number'] <= 30].groupby(date_col).agg(agg_dict).reset_index()
+    df_agg = df[df['row_number'] <= periods].groupby(date_col).agg(agg_dict).reset_index()
     
-    # 仅当 backdiamond 存在时才进行计算
-    if 'backdiamond' in df_agg.columns:
-        df_agg['freediamond'] += df_agg['backdiamond']
-    
-    if 'pu' in df_agg.columns and 'au' in df_agg.columns and df_agg['au'].sum() > 0:
-        df_agg['pr'] = (df_agg['pu'] / df_agg['au']).fillna(0)
-    else:
-        df_agg['pr'] = 0
+    # 免费钻石含返还钻石 (backdiamond 存在时), 参与率分母为0时记为0
+    df_agg['freediamond'] = derived.evaluate(df_agg, ['freediamond_total'])['freediamond_total']
+    df_agg['pr'] = derived.evaluate(df_agg, ['pr']).get('pr', 0)
 
     fig, ax1 = plt.subplots(figsize=(14, 7), tight_layout=True)
     
@@ -53,47 +48,50 @@ def _plot_activity_overview(df: pd.DataFrame, activity_name: str, date_col='date
 def _plot_activity_cohort_analysis(df: pd.DataFrame, activity_name: str):
     """通用函数: 按zonetype和viptype绘制活动的群组分析图"""
     
-    # 动态构建聚合字典
-    agg_dict = {'freediamond': 'sum', 'paiddiamond': 'sum', 'au': 'sum', 'pu': 'sum'}
+    # 动态构建聚合列
+    values = ['freediamond', 'paiddiamond', 'au', 'pu']
     if 'backdiamond' in df.columns:
-        agg_dict['backdiamond'] = 'sum'
+        values.append('backdiamond')
     if 'sales' in df.columns:
-        agg_dict['sales'] = 'sum'
+        values.append('sales')
 
-    df_agg = df[df['row_number'] <= 5].groupby(['row_number', 'day', 'zonetype', 'viptype_code']) \
-        .agg(agg_dict).reset_index()
+    # 一次聚合为 (日期, zonetype, viptype_code) 稠密数组, 绘图时直接按下标取值
+    df_recent = df[df['row_number'] <= 5]
+    cube, coords = processors.build_cube(
+        df_recent, dims=['date', 'zonetype', 'viptype_code'], values=values,
+        coords={'zonetype': config.ZONE_TYPE_ORDER, 'viptype_code': range(len(config.VIP_TYPE_LABELS))})
 
     # 根据可用数据动态构建要绘制的指标
     metrics = {}
-    if 'sales' in df_agg.columns:
+    if 'sales' in cube:
         metrics['sales'] = 'Sales (CNY)'
-    
-    if all(k in df_agg for k in ['pu', 'au']) and df_agg['au'].sum() > 0:
-        df_agg['pr'] = (df_agg['pu'] / df_agg['au']).fillna(0)
-        metrics['pr'] = 'Participation Rate'
 
-    if all(k in df_agg for k in ['freediamond', 'paiddiamond', 'pu']) and df_agg['pu'].sum() > 0:
-        if 'backdiamond' in df_agg.columns:
-            df_agg['total_diamond'] = df_agg['freediamond'] + df_agg['paiddiamond'] + df_agg['backdiamond']
-        else:
-            df_agg['total_diamond'] = df_agg['freediamond'] + df_agg['paiddiamond']
-        df_agg['avgdiamond'] = (df_agg['total_diamond'] / df_agg['pu']).fillna(0)
+    # 派生指标: 空单元格保持NaN (不绘制), 分母为0按0处理
+    if df_recent['au'].sum() > 0:
+        derived.evaluate(cube, ['pr'])
+        metrics['pr'] = 'Participation Rate'
+    if df_recent['pu'].sum() > 0:
+        derived.evaluate(cube, ['avgdiamond'])
         metrics['avgdiamond'] = 'Avg. Diamond Spend per User'
 
     if not metrics:
         print(f"No metrics to plot for {activity_name} cohort analysis.")
         return
-    
+
+    has_data = ~np.isnan(cube['au'])
+
+    viptype_codes = coords['viptype_code'].to_numpy()
+    # 最新日期在前
+    dim_date = list(enumerate(coords['date']))[::-1]
+
     for metric, title in metrics.items():
         fig, axes = plt.subplots(1, 5, figsize=(14, 7), sharey=True, tight_layout=True)
-        dim_date = df_agg['day'].unique()
 
         for i, zonetype in enumerate(config.ZONE_TYPE_ORDER):
             ax = axes[i]
-            zone_data = df_agg[df_agg['zonetype'] == zonetype]
-            for j, day in enumerate(dim_date):
-                day_data = zone_data[zone_data['day'] == day].sort_values('viptype_code')
-                ax.plot(day_data['viptype_code'], day_data[metric], linewidth=2.0, linestyle='-', label=pd.to_datetime(day).strftime('%Y-%m-%d'))
+            for j, date in dim_date:
+                present = has_data[j, i]
+                ax.plot(viptype_codes[present], cube[metric][j, i][present], linewidth=2.0, linestyle='-', label=date.strftime('%Y-%m-%d'))
             
             ax.set_xticks(range(len(config.VIP_TYPE_LABELS)))
             ax.set_xticklabels(config.VIP_TYPE_LABELS, rotation=45, ha='right')
@@ -109,81 +107,89 @@ def _plot_activity_cohort_analysis(df: pd.DataFrame, activity_name: str):
 # Specific Activity Plotting Functions
 # ----------------------------------
 
-def plot_prizewheel(df: pd.DataFrame):
+def plot_prizewheel(df: pd.DataFrame, periods=30):
     """为转盘活动生成所有图表"""
     activity_name = "Prizewheel"
     df_processed = processors.process_activity_data(df)
     
-    _plot_activity_overview(df_processed, activity_name)
+    _plot_activity_overview(df_processed, activity_name, periods=periods)
     _plot_activity_cohort_analysis(df_processed, activity_name)
 
-def plot_forcecard(df: pd.DataFrame):
+def plot_forcecard(df: pd.DataFrame, periods=30):
     """为原力活动生成所有图表"""
     activity_name = "Forcecard"
     df_processed = processors.process_activity_data(df)
     
-    _plot_activity_overview(df_processed, activity_name)
+    _plot_activity_overview(df_processed, activity_name, periods=periods)
     _plot_activity_cohort_analysis(df_processed, activity_name)
 
-def plot_soulstonebox(df: pd.DataFrame):
+def plot_soulstonebox(df: pd.DataFrame, periods=30):
     """为魂匣活动生成所有图表"""
     activity_name = "SoulstoneBox"
     
     # 总览和群组分析
     df_total = df[df['card_id'] == 'total'].copy()
     df_processed = processors.process_activity_data(df_total)
-    _plot_activity_overview(df_processed, activity_name)
+    _plot_activity_overview(df_processed, activity_name, periods=periods)
     _plot_activity_cohort_analysis(df_processed, activity_name)
 
     # 卡片特定分析
     df_cards = df[df['card_id'] != 'total'].copy()
     df_cards_processed = processors.process_activity_data(df_cards)
-    df_latest = df_cards_processed[df_cards_processed['row_number'] == 1].groupby(['date', 'card_name', 'zonetype', 'viptype_code']) \
-        .agg({'au': 'sum', 'pu': 'sum', 'freediamond':'sum', 'paiddiamond':'sum'}).reset_index()
-    
-    if 'pu' in df_latest.columns and df_latest['pu'].sum() > 0:
-        df_latest['avgdiamond'] = ((df_latest['freediamond'] + df_latest['paiddiamond']) / df_latest['pu']).fillna(0)
+    df_latest = df_cards_processed[df_cards_processed['row_number'] == 1]
+
+    # 一次聚合为 (zonetype, viptype_code, card_name) 稠密数组
+    cube, coords = processors.build_cube(
+        df_latest, dims=['zonetype', 'viptype_code', 'card_name'], values=['au', 'pu', 'freediamond', 'paiddiamond'],
+        coords={'zonetype': config.ZONE_TYPE_ORDER, 'viptype_code': range(len(config.VIP_TYPE_LABELS))})
+    has_data = ~np.isnan(cube['pu'])
+
+    if np.nansum(cube['pu']) > 0:
+        avgdiamond = derived.evaluate(cube, ['avgdiamond'])['avgdiamond']
     else:
-        df_latest['avgdiamond'] = 0
+        avgdiamond = np.where(has_data, 0.0, np.nan)
+
+    card_names = coords['card_name'].to_numpy()
+    pu_max = np.nanmax(cube['pu']) if has_data.any() else None
 
     fig, axes = plt.subplots(5, 5, figsize=(16, 12), sharey='row', sharex=True, tight_layout=True)
     
     for i, zonetype in enumerate(config.ZONE_TYPE_ORDER):
         for j, viptype in enumerate(range(len(config.VIP_TYPE_LABELS)-1)): # Exclude '非R'
             ax = axes[i, j]
-            data = df_latest[(df_latest['zonetype'] == zonetype) & (df_latest['viptype_code'] == viptype)]
+            present = has_data[i, j]
             
-            ax.bar(data['card_name'], data['avgdiamond'], label='Avg. Diamond Spend per User')
+            ax.bar(card_names[present], avgdiamond[i, j][present], label='Avg. Diamond Spend per User')
             ax.tick_params(axis='x', labelsize=8, rotation=90)
             
             if j == 0: ax.set_ylabel(zonetype, fontsize=10)
             if i == 0: ax.set_title(config.VIP_TYPE_LABELS[j], loc='center', fontsize=10)
             
             ax2 = ax.twinx()
-            ax2.plot(data['card_name'], data['pu'], linewidth=2.0, linestyle='-', color='#ff7f0e', label='Participant Count')
-            if not df_latest.empty and 'pu' in df_latest.columns:
-                ax2.set_ylim(0, df_latest['pu'].max() * 1.1)
+            ax2.plot(card_names[present], cube['pu'][i, j][present], linewidth=2.0, linestyle='-', color='#ff7f0e', label='Participant Count')
+            if pu_max is not None:
+                ax2.set_ylim(0, pu_max * 1.1)
             ax2.grid(False)
 
     fig.suptitle(f'Latest {activity_name}: Spend per User & Participant Count by Card', x=0.03, y=.98, ha='left', fontsize=20)
     save_plot(fig, f'activity_{activity_name.lower()}_card_analysis.jpg', subdirectory='activities')
 
 
-def plot_themegacha(df: pd.DataFrame):
+def plot_themegacha(df: pd.DataFrame, periods=30):
     """为主题召唤生成所有图表"""
     activity_name = "ThemeGacha"
     df_processed = processors.process_activity_data(df)
     
-    _plot_activity_overview(df_processed, activity_name)
+    _plot_activity_overview(df_processed, activity_name, periods=periods)
     _plot_activity_cohort_analysis(df_processed, activity_name)
 
-def plot_wishpool(df: pd.DataFrame):
-    """为许愿池生成所有图表"""
+def plot_wishpool(df: pd.DataFrame, periods=15):
+    """为许愿池生成所有图表 (收入概览显示最近periods期)"""
     activity_name = "Wishpool"
     df_processed = processors.process_activity_data(df)
     
     # 总体收入概览
-    df_recent = df_processed[df_processed['row_number'] <= 15]
+    df_recent = df_processed[df_processed['row_number'] <= periods]
     if 'sales' in df_recent.columns:
         df_agg = df_recent.groupby(['date', 'viptype_code']).agg({'sales': "sum"}).reset_index()
         fig, ax = plt.subplots(figsize=(14, 7), tight_layout=True)
@@ -197,11 +203,7 @@ def plot_wishpool(df: pd.DataFrame):
     df_heat = df_processed[df_processed['row_number'] <= 6].groupby(['date', 'viptype_code']) \
         .agg(au=('au', 'sum'), cu=('cu', 'sum'), sales=('sales', 'sum')).reset_index()
     
-    if 'sales' in df_heat.columns:
-        df_heat['arpu'] = (df_heat['sales'] / df_heat['au']).fillna(0)
-        df_heat['arppu'] = (df_heat['sales'] / df_heat['cu']).fillna(0)
-    if 'cu' in df_heat.columns and 'au' in df_heat.columns:
-        df_heat['payrate'] = (df_heat['cu'] / df_heat['au']).fillna(0)
+    derived.evaluate(df_heat, ['arpu', 'arppu', 'payrate'])
 
     fig, axes = plt.subplots(2, 2, figsize=(14, 10), tight_layout=True)
     
@@ -211,12 +213,11 @@ def plot_wishpool(df: pd.DataFrame):
     if 'arpu' in df_heat.columns: metrics['arpu'] = 'ARPU'
     if 'payrate' in df_heat.columns: metrics['payrate'] = 'Pay Rate'
     
-    cmap = plt.cm.get_cmap('RdYlBu_r')
+    cmap = plt.get_cmap('RdYlBu_r')
 
     for ax, (metric, title) in zip(axes.flatten(), metrics.items()):
-        pivot_df = df_heat.pivot_table(index='date', columns='viptype_code', values=metric).fillna(0)
-        sns.heatmap(pivot_df, ax=ax, annot=True, fmt='.2f' if metric in ['payrate', 'arpu'] else 'g', cmap=cmap)
-        ax.set_title(title, loc='left')
+        pivot_df = plot_heatmap(df_heat, ax, 'date', 'viptype_code', metric, title, values=list(metrics),
+                                fmt='.2f' if metric in ['payrate', 'arpu'] else 'g', cmap=cmap)
         ax.set_yticklabels([d.strftime('%Y-%m-%d') for d in pivot_df.index], rotation=0)
         ax.set_xticklabels(config.VIP_TYPE_LABELS, rotation=45, ha='right')
 
@@ -224,20 +225,26 @@ def plot_wishpool(df: pd.DataFrame):
     save_plot(fig, f'activity_{activity_name.lower()}_heatmap.jpg', subdirectory='activities')
 
 
+# 图表注册表: 图表名 -> 数据源工作表、绘图函数及所需的日期窗口
+# 活动图表最多使用最近30期 (row_number <= 30)
+# range: 概览图默认显示的最近期数, 可由 CHART_RANGES 或 --range 覆盖; 许愿池概览默认15期
+# 魂匣的总计与卡片分别排名, 无法共用一个窗口, 因此整表读取
+# chunked: 设置内存预算时分块读取并边读边聚合; 魂匣先按卡片筛选再处理, 不能分块
+CHARTS = {
+    'prizewheel': {'sheet': 'ACT_PRIZEWHEEL', 'plot': plot_prizewheel,
+                   'window': loader.RowWindow('day', 30), 'range': 30, 'chunked': True},
+    'forcecard': {'sheet': 'ACT_INTERZONE_FORCECARD', 'plot': plot_forcecard,
+                  'window': loader.RowWindow('day', 30), 'range': 30, 'chunked': True},
+    'soulstonebox': {'sheet': 'ACT_SOULSTONEBOX', 'plot': plot_soulstonebox, 'range': 30},
+    'themegacha': {'sheet': 'ACT_THEMEGACHA', 'plot': plot_themegacha,
+                   'window': loader.RowWindow('day', 30), 'range': 30, 'chunked': True},
+    'wishpool': {'sheet': 'ACT_WISHPOOL', 'plot': plot_wishpool,
+                 'window': loader.RowWindow('day', 30), 'range': 15, 'chunked': True},
+}
+
 def generate_all():
     """生成所有活动相关的图表"""
     print("\n--- Generating Activity Plots ---")
-
-    activities_map = {
-        'Prizewheel': ('ACT_PRIZEWHEEL', plot_prizewheel),
-        'Forcecard': ('ACT_INTERZONE_FORCECARD', plot_forcecard),
-        'SoulstoneBox': ('ACT_SOULSTONEBOX', plot_soulstonebox),
-        'ThemeGacha': ('ACT_THEMEGACHA', plot_themegacha),
-        'Wishpool': ('ACT_WISHPOOL', plot_wishpool),
-    }
-
-    for name, (sheet, plot_func) in activities_map.items():
-        print(f"\n-- Plotting for {name} --")
-        df = loader.load_sheet(sheet)
-        if df is not None:
-            plot_func(df)
+    # runner imports the report modules, so import it only when called
+    from ..core import runner
+    runner.generate_module('activities')
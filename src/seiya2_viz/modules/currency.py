@@ -3,12 +3,15 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from ..core import loader
 from .. import config
-from ..core import processors
+from ..core import processors, timeindex
 from ..utils.plotting import save_plot, plot_stacked_bar
+from ..utils.downsample import downsample
 
-def plot_cur_spend(df: pd.DataFrame):
-    """生成钻石消耗图表"""
-    df_processed = processors.process_cur_spend_data(df)
+def plot_cur_spend(df: pd.DataFrame, periods=90):
+    """生成钻石消耗图表 (最近periods天)"""
+    df_processed = processors.process_cur_spend_data(df, days=periods)
+    # 范围较长时拉大刻度间隔, 保持约13个日期标签
+    tick_step = 7 * max(1, periods // 90)
     
     fig, ax = plt.subplots(2, 1, figsize=(14, 10), tight_layout=True)
 
@@ -16,27 +19,28 @@ def plot_cur_spend(df: pd.DataFrame):
     plot_stacked_bar(
         df=df_processed, ax=ax[0], x_col='day', y_col='totaldiamond', 
         category_col='a_typ', title='Total Diamond Spend by Activity', 
-        ylabel='Net Diamond Spend', legend_loc='upper left'
+        ylabel='Net Diamond Spend', legend_loc='upper left', values=['totaldiamond', 'paiddiamond']
     )
-    ax[0].xaxis.set_major_locator(plt.MultipleLocator(7))
+    ax[0].xaxis.set_major_locator(plt.MultipleLocator(tick_step))
     ax[0].tick_params(axis='x', rotation=0)
 
     # 付费钻石消耗
     plot_stacked_bar(
         df=df_processed, ax=ax[1], x_col='day', y_col='paiddiamond', 
         category_col='a_typ', title='Paid Diamond Spend by Activity', 
-        ylabel='Paid Diamond Spend', legend_loc='upper left'
+        ylabel='Paid Diamond Spend', legend_loc='upper left', values=['totaldiamond', 'paiddiamond']
     )
-    ax[1].xaxis.set_major_locator(plt.MultipleLocator(7))
+    ax[1].xaxis.set_major_locator(plt.MultipleLocator(tick_step))
     ax[1].tick_params(axis='x', rotation=0)
 
     fig.suptitle('Diamond Spend Analysis', x=0.03, y=.99, ha='left', fontsize=20)
     save_plot(fig, 'currency_spend.jpg', subdirectory='currency')
 
-def plot_cur_stock(df: pd.DataFrame):
-    """生成按VIP等级划分的钻石持有量图表"""
-    df['day'] = pd.to_datetime(df.day, format='%Y%m%d')
-    df_recent = df.sort_values(by='day', ascending=True).iloc[-60:]
+def plot_cur_stock(df: pd.DataFrame, periods=60):
+    """生成按VIP等级划分的钻石持有量图表 (最近periods天)"""
+    df = timeindex.set_time_index(df, 'day')
+    df_recent = timeindex.last_rows(df, periods).copy()
+    df_recent['day'] = df_recent.index
 
     fig = plt.figure(figsize=(14, 8), tight_layout=True)
     gs = fig.add_gridspec(3, 1) # 创建一个3行1列的网格
@@ -44,8 +48,9 @@ def plot_cur_stock(df: pd.DataFrame):
     # 高VIP
     ax0 = fig.add_subplot(gs[0, 0])
     vip_high = ['v18', 'v17', 'v16', 'v15']
+    # 每条折线的点数超过MAX_POINTS时用LTTB降采样
     for v in vip_high:
-        ax0.plot(df_recent['day'], df_recent[v], label=v, linewidth=2.5)
+        ax0.plot(*downsample(df_recent['day'], df_recent[v]), label=v, linewidth=2.5)
     ax0.set_ylabel('High VIP (v15-v18)')
     ax0.legend(loc='upper left')
     ax0.set_ylim(bottom=80000)
@@ -54,7 +59,7 @@ def plot_cur_stock(df: pd.DataFrame):
     ax1 = fig.add_subplot(gs[1, 0], sharex=ax0)
     vip_mid = ['v12', 'v11', 'v10', 'v09']
     for v in vip_mid:
-        ax1.plot(df_recent['day'], df_recent[v], label=v, linewidth=2.5)
+        ax1.plot(*downsample(df_recent['day'], df_recent[v]), label=v, linewidth=2.5)
     ax1.set_ylabel('Mid VIP (v9-v12)')
     ax1.legend(loc='upper left')
     ax1.set_ylim(20000, 50000)
@@ -63,7 +68,7 @@ def plot_cur_stock(df: pd.DataFrame):
     ax2 = fig.add_subplot(gs[2, 0], sharex=ax0)
     vip_low = ['v08', 'v07', 'v06', 'v05']
     for v in vip_low:
-        ax2.plot(df_recent['day'], df_recent[v], label=v, linewidth=2.5)
+        ax2.plot(*downsample(df_recent['day'], df_recent[v]), label=v, linewidth=2.5)
     ax2.set_ylabel('Low VIP (v5-v8)')
     ax2.legend(loc='upper left')
     ax2.set_ylim(0, 20000)
@@ -75,16 +80,21 @@ def plot_cur_stock(df: pd.DataFrame):
     fig.suptitle('Diamond Holdings by VIP Level', x=0.03, y=.98, ha='left', fontsize=20)
     save_plot(fig, 'currency_stock_by_vip.jpg', subdirectory='currency')
 
+# 图表注册表: 图表名 -> 数据源工作表、绘图函数及所需的日期窗口
+# range: 默认显示的最近天数, 可由 CHART_RANGES 或 --range 覆盖
+# chunked: 设置内存预算时分块读取并边读边聚合 (处理函数只做求和)
+CHARTS = {
+    # 货币消耗 (移除usecols限制，以确保'backdiamond'列被加载)
+    'spend': {'sheet': 'CUR_SPEND', 'plot': plot_cur_spend,
+              'window': loader.RowWindow('day', 90, unit='days'), 'range': 90, 'chunked': True},
+    # 货币存量
+    'stock': {'sheet': 'CUR_STOCK', 'usecols': range(21), 'plot': plot_cur_stock,
+              'window': loader.RowWindow('day', 60), 'range': 60},
+}
+
 def generate_all():
     """生成所有货币相关的图表"""
     print("\n--- Generating Currency Plots ---")
-    
-    # 货币消耗 (移除usecols限制，以确保'backdiamond'列被加载)
-    df_spend = loader.load_sheet('CUR_SPEND')
-    if df_spend is not None:
-        plot_cur_spend(df_spend)
-
-    # 货币存量
-    df_stock = loader.load_sheet('CUR_STOCK', usecols=range(21))
-    if df_stock is not None:
-        plot_cur_stock(df_stock)
+    # runner imports the report modules, so import it only when called
+    from ..core import runner
+    runner.generate_module('currency')
@@ -1,8 +1,7 @@
 # plotting/hero.py
 import pandas as pd
 import matplotlib.pyplot as plt
-from ..core import loader
-from ..utils.plotting import save_plot
+from ..utils.plotting import save_plot, add_value_labels
 
 def plot_hero_hold(df: pd.DataFrame):
     """生成核心角色持有人数图表"""
@@ -14,11 +13,8 @@ def plot_hero_hold(df: pd.DataFrame):
     ax.plot(df_core_heroes['card_name'], df_core_heroes['hu_lw'], linewidth=3.0, linestyle='-', marker='x', label='Last Week Holders')
 
     # 添加数据标签
-    for x, y in zip(df_core_heroes['card_name'], df_core_heroes['hu_lw']):
-        ax.text(x, y - 500, str(y), ha='center', va='bottom', fontsize=9, color='#ff7f0e')
-
-    for x, y in zip(df_core_heroes['card_name'], df_core_heroes['hu_tw']):
-        ax.text(x, y + 200, str(y), ha='center', va='bottom', fontsize=9, color='#006767')
+    add_value_labels(ax, df_core_heroes['card_name'], df_core_heroes['hu_lw'], offset=-500, fontsize=9, color='#ff7f0e')
+    add_value_labels(ax, df_core_heroes['card_name'], df_core_heroes['hu_tw'], offset=200, fontsize=9, color='#006767')
 
     ax.tick_params(axis='x', rotation=90, labelsize=10)
     ax.legend(loc='upper right', fontsize=12)
@@ -28,10 +24,14 @@ def plot_hero_hold(df: pd.DataFrame):
     
     save_plot(fig, 'hero_hold_core.jpg', subdirectory='hero')
 
+# 图表注册表: 图表名 -> 数据源工作表和绘图函数
+CHARTS = {
+    'hold': {'sheet': 'HERO_HOLD', 'usecols': range(7), 'plot': plot_hero_hold},
+}
+
 def generate_all():
     """生成所有英雄相关的图表"""
     print("\n--- Generating Hero Plots ---")
-    
-    df_hero = loader.load_sheet('HERO_HOLD', usecols=range(7))
-    if df_hero is not None:
-        plot_hero_hold(df_hero)
+    # runner imports the report modules, so import it only when called
+    from ..core import runner
+    runner.generate_module('hero')
@@ -1,122 +1,132 @@
 # plotting/kpi.py
 import pandas as pd
 import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
 from ..core import loader
 from .. import config
-from ..core import processors
-from ..utils.plotting import save_plot, plot_stacked_bar
+from ..core import processors, timeindex
+from ..utils.plotting import save_plot, plot_stacked_bar, add_value_labels
+from ..utils.downsample import downsample
 
-def plot_kpi_weekly(df: pd.DataFrame):
-    """生成周KPI概览图表"""
-    df['week'] = pd.to_datetime(df.week, format='%Y%m%d')
-    df_sorted = df.sort_values(by='weekid', ascending=True).iloc[:15]
+def plot_kpi_weekly(df: pd.DataFrame, periods=15):
+    """生成周KPI概览图表 (最近periods周)"""
+    # 按解析后的周日期作图, 跨年时折线不会回跳
+    df = timeindex.set_time_index(df, 'week')
+    df_sorted = timeindex.last_rows(df, periods)
+    weeks = df_sorted.index
+    # 周数较多时隐藏重叠的数值标签
+    thin = len(df_sorted) > 15
 
     fig, ax = plt.subplots(2, 1, figsize=(14, 7), sharex=True, tight_layout=True)
     
-    # WAU/WNU/WOU图
-    ax[0].bar(df_sorted['md'], df_sorted['wou'], width=0.5, label='wou')
-    ax[0].bar(df_sorted['md'], df_sorted['wnu'], width=0.5, bottom=df_sorted['wou'], label='wnu')
-    ax[0].plot(df_sorted['md'], df_sorted['wau'], linewidth=3.5, c='#2ca02c', label='wau')
+    # WAU/WNU/WOU图 (柱宽以天为单位)
+    ax[0].bar(weeks, df_sorted['wou'], width=3.5, label='wou')
+    ax[0].bar(weeks, df_sorted['wnu'], width=3.5, bottom=df_sorted['wou'], label='wnu')
+    ax[0].plot(weeks, df_sorted['wau'], linewidth=3.5, c='#2ca02c', label='wau')
     ax[0].set_ylabel('WAU', fontsize=14, fontstyle='italic')
     ax[0].set_ylim(10000, 35000)
     ax[0].legend()
-    for x, y in zip(df_sorted['md'], df_sorted['wau']):
-        ax[0].text(x, y + 100, f'{y}', ha='center', va='bottom', fontsize=10)
+    add_value_labels(ax[0], weeks, df_sorted['wau'], offset=100, fontsize=10, thin=thin)
 
     # 收入图
     revenue = df_sorted['sales'] // 10000
-    ax[1].plot(df_sorted['md'], revenue, linewidth=3.0)
+    ax[1].plot(weeks, revenue, linewidth=3.0)
     ax[1].set_ylabel('Weekly Revenue (10k units)', fontsize=14, fontstyle='italic')
-    ax[1].xaxis.set_major_locator(plt.MultipleLocator(2))
-    for x, y in zip(df_sorted['md'], revenue):
-        ax[1].text(x, y + 0.5, f'{y}W', ha='center', va='bottom', fontsize=10)
+    # 按日期范围选取刻度, 跨年时标出年份
+    locator = mdates.AutoDateLocator(minticks=5, maxticks=16)
+    ax[1].xaxis.set_major_locator(locator)
+    ax[1].xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+    add_value_labels(ax[1], weeks, revenue, labels=[f'{y}W' for y in revenue], offset=0.5, fontsize=10,
+                     thin=thin)
 
     fig.suptitle('Weekly KPI Summary', x=0.02, y=.98, ha='left', fontsize=20)
     save_plot(fig, 'kpi_weekly_overview.jpg', subdirectory='kpi')
 
-def plot_kpi_daily(df: pd.DataFrame):
-    """生成日KPI图表 (DAU/Revenue and ARPU/ARPPU/PR)"""
-    df['day'] = pd.to_datetime(df.day, format='%Y%m%d')
-    df_sorted = df.sort_values(by='day', ascending=True).iloc[:31]
+def plot_kpi_daily(df: pd.DataFrame, periods=31):
+    """生成日KPI图表 (DAU/Revenue and ARPU/ARPPU/PR, 最近periods天)"""
+    df = timeindex.set_time_index(df, 'day')
+    df_sorted = timeindex.last_rows(df, periods).copy()
+    df_sorted['day'] = df_sorted.index
 
     # DAU & Revenue图
     fig1, ax1 = plt.subplots(2, 1, figsize=(14, 7), sharex=True, tight_layout=True)
     ax1[0].bar(df_sorted['day'], df_sorted['dou'], width=0.5, label='dou')
     ax1[0].bar(df_sorted['day'], df_sorted['dnu'], width=0.5, bottom=df_sorted['dou'], label='dnu')
-    ax1[0].plot(df_sorted['day'], df_sorted['dau'], linewidth=3.0, label='dau')
+    # 折线点数超过MAX_POINTS时用LTTB降采样
+    ax1[0].plot(*downsample(df_sorted['day'], df_sorted['dau']), linewidth=3.0, label='dau')
     ax1[0].set_ylabel('DAU', fontsize=14)
     ax1[0].set_ylim(5000, 25000)
     ax1[0].legend()
     fig1.suptitle('Daily KPI Summary', x=0.03, y=.98, ha='left', fontsize=20)
     
     revenue = df_sorted['sales'] // 10000
-    ax1[1].plot(df_sorted['day'], revenue, linewidth=3.0)
+    ax1[1].plot(*downsample(df_sorted['day'], revenue), linewidth=3.0)
     ax1[1].set_ylabel('Daily Revenue (10k units)', fontsize=14)
     save_plot(fig1, 'kpi_daily_dau_revenue.jpg', subdirectory='kpi')
 
     # ARPU, ARPPU, PR图
     fig2, ax2 = plt.subplots(3, 1, figsize=(14, 7), sharex=True, tight_layout=True)
-    ax2[0].plot(df_sorted['day'], df_sorted['arpu'], label='arpu', linewidth=3.0)
-    ax2[1].plot(df_sorted['day'], df_sorted['arppu'], label='arppu', linewidth=3.0)
-    ax2[2].plot(df_sorted['day'], df_sorted['payrate'], label='payrate', linewidth=3.0)
+    ax2[0].plot(*downsample(df_sorted['day'], df_sorted['arpu']), label='arpu', linewidth=3.0)
+    ax2[1].plot(*downsample(df_sorted['day'], df_sorted['arppu']), label='arppu', linewidth=3.0)
+    ax2[2].plot(*downsample(df_sorted['day'], df_sorted['payrate']), label='payrate', linewidth=3.0)
     ax2[0].set_ylabel('ARPU')
     ax2[1].set_ylabel('ARPPU')
     ax2[2].set_ylabel('Pay Rate')
     fig2.suptitle('Daily ARPU, ARPPU & Pay Rate', x=0.03, y=.98, ha='left', fontsize=20)
     save_plot(fig2, 'kpi_daily_arpu_pr.jpg', subdirectory='kpi')
 
-def plot_kpi_channel(df: pd.DataFrame):
-    """生成渠道来源的WAU和WNU图表"""
-    df_processed = processors.process_kpi_channel_data(df)
+def plot_kpi_channel(df: pd.DataFrame, periods=6):
+    """生成渠道来源的WAU和WNU图表 (最近periods周)"""
+    df_processed = processors.process_kpi_channel_data(df, weeks=periods)
     
     fig, ax = plt.subplots(1, 2, figsize=(14, 7), sharex=True, tight_layout=True)
     
-    plot_stacked_bar(df_processed, ax[0], x_col='md', y_col='wau', category_col='affcode', title='WAU by Source', ylabel='WAU')
+    plot_stacked_bar(df_processed, ax[0], x_col='md', y_col='wau', category_col='affcode', title='WAU by Source', ylabel='WAU',
+                     values=['wau', 'wnu'])
     ax[0].legend(loc='upper left', fontsize=8)
 
-    plot_stacked_bar(df_processed, ax[1], x_col='md', y_col='wnu', category_col='affcode', title='WNU by Source', ylabel='WNU')
+    plot_stacked_bar(df_processed, ax[1], x_col='md', y_col='wnu', category_col='affcode', title='WNU by Source', ylabel='WNU',
+                     values=['wau', 'wnu'])
     ax[1].get_legend().remove() # 移除第二个图的图例以避免重复
 
     fig.suptitle('Weekly User Acquisition by Source', x=0.03, y=.98, ha='left', fontsize=20)
     save_plot(fig, 'kpi_channel_source.jpg', subdirectory='kpi')
 
-def plot_kpi_user(df: pd.DataFrame):
-    """按注册日期生成WAU和Sales图表"""
-    df['week'] = pd.to_datetime(df.week, format='%Y%m%d')
-    df_recent = df[df['weekid'] > (df['weekid'].max() - 15)]
-    df_agg = df_recent.groupby(['weekid', 'md', 'regmonth2']).agg({'wau': "sum", 'wsales': "sum"}).reset_index()
+def plot_kpi_user(df: pd.DataFrame, periods=15):
+    """按注册日期生成WAU和Sales图表 (最近periods周)"""
+    df_recent = df[df['weekid'] > (df['weekid'].max() - periods)]
+    df_agg = df_recent.groupby(['weekid', 'md', 'regmonth2'], observed=True).agg({'wau': "sum", 'wsales': "sum"}).reset_index()
 
     fig, ax = plt.subplots(2, 1, figsize=(14, 10), tight_layout=True)
     
-    plot_stacked_bar(df_agg, ax[0], x_col='md', y_col='wau', category_col='regmonth2', title='WAU by Registration Cohort', ylabel='WAU')
-    ax[0].xaxis.set_major_locator(plt.MultipleLocator(2))
+    plot_stacked_bar(df_agg, ax[0], x_col='md', y_col='wau', category_col='regmonth2', title='WAU by Registration Cohort', ylabel='WAU',
+                     values=['wau', 'wsales'])
+    ax[0].xaxis.set_major_locator(plt.MultipleLocator(max(2, periods // 8)))
     
-    plot_stacked_bar(df_agg, ax[1], x_col='md', y_col='wsales', category_col='regmonth2', title='Weekly Sales by Registration Cohort', ylabel='Weekly Sales')
-    ax[1].xaxis.set_major_locator(plt.MultipleLocator(2))
+    plot_stacked_bar(df_agg, ax[1], x_col='md', y_col='wsales', category_col='regmonth2', title='Weekly Sales by Registration Cohort', ylabel='Weekly Sales',
+                     values=['wau', 'wsales'])
+    ax[1].xaxis.set_major_locator(plt.MultipleLocator(max(2, periods // 8)))
 
     fig.suptitle('User KPIs by Registration Cohort', x=0.03, y=.99, ha='left', fontsize=20)
     save_plot(fig, 'kpi_user_cohort.jpg', subdirectory='kpi')
 
+# 图表注册表: 图表名 -> 数据源工作表、绘图函数及所需的日期窗口
+# range: 默认显示的最近周期数 (周/天), 可由 CHART_RANGES 或 --range 覆盖
+# chunked: 设置内存预算时分块读取并边读边聚合 (处理函数只做求和)
+CHARTS = {
+    'weekly': {'sheet': 'KPI_WKLY', 'plot': plot_kpi_weekly,         # 周KPI
+               'window': loader.RowWindow('weekid', 15), 'range': 15},
+    'daily': {'sheet': 'KPI_DAILY', 'plot': plot_kpi_daily,          # 日KPI
+              'window': loader.RowWindow('day', 31), 'range': 31},
+    'channel': {'sheet': 'KPI_CHANNEL', 'plot': plot_kpi_channel,    # 渠道KPI
+                'window': loader.RowWindow('weekid', 6), 'range': 6, 'chunked': True},
+    'user': {'sheet': 'KPI_USER', 'plot': plot_kpi_user,             # 用户KPI
+             'window': loader.RowWindow('weekid', 15), 'range': 15},
+}
+
 def generate_all():
     """生成所有KPI相关的图表"""
     print("\n--- Generating KPI Plots ---")
-    
-    # 周KPI
-    df_wkly = loader.load_sheet('KPI_WKLY')
-    if df_wkly is not None:
-        plot_kpi_weekly(df_wkly)
-        
-    # 日KPI
-    df_daily = loader.load_sheet('KPI_DAILY')
-    if df_daily is not None:
-        plot_kpi_daily(df_daily)
-        
-    # 渠道KPI
-    df_channel = loader.load_sheet('KPI_CHANNEL')
-    if df_channel is not None:
-        plot_kpi_channel(df_channel)
-        
-    # 用户KPI
-    df_user = loader.load_sheet('KPI_USER')
-    if df_user is not None:
-        plot_kpi_user(df_user)
+    # runner imports the report modules, so import it only when called
+    from ..core import runner
+    runner.generate_module('kpi')
@@ -3,22 +3,18 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from ..core import loader
 from .. import config
-from ..utils.plotting import save_plot
+from ..core import processors, timeindex
+from ..utils.plotting import save_plot, pivot
 
-def plot_kpi_zone(df: pd.DataFrame):
-    """生成按战区划分的WNU和Sales图表"""
-    df['date'] = pd.to_datetime(df.day, format='%Y%m%d')
-    df_recent = df[df['date'].isin(pd.date_range(df['date'].max() - pd.to_timedelta(50, unit="D"), df['date'].max()))].copy()
+def plot_kpi_zone(df: pd.DataFrame, periods=50):
+    """生成按战区划分的WNU和Sales图表 (最近periods天)"""
+    df = timeindex.set_time_index(df, 'day')
+    df_recent = timeindex.last_days(df, periods)
 
-    # 对user_type进行排名和分组
-    rkdk_zone = df_recent.groupby('user_type')['wnu'].sum().reset_index()
-    rkdk_zone = rkdk_zone.sort_values(by='wnu', ascending=False).reset_index(drop=True)
-    rkdk_zone['row_number'] = rkdk_zone['wnu'].rank(ascending=False, method='first')
-    
-    df_merged = pd.merge(df_recent, rkdk_zone[['user_type', 'row_number']], how='left', on='user_type')
-    df_merged.loc[df_merged["row_number"] >= 9, 'user_type'] = 'OU_其他来源'
-    
-    df_agg = df_merged.groupby(['day', 'zone', 'zone_type', 'user_type']).agg({'wnu': "sum", 'wsales': "sum"}).reset_index()
+    # 对user_type按WNU排名, 保留前8, 其余归为其他来源并重新聚合
+    df_agg = processors.bucket_top_n(df_recent, key='user_type', rank_by='wnu', n=8,
+                                     group_cols=['day', 'zone', 'zone_type', 'user_type'],
+                                     values=['wnu', 'wsales'], other_label='OU_其他来源')
 
     fig = plt.figure(figsize=(14, 8), tight_layout=True)
     gs = fig.add_gridspec(2, 3, width_ratios=[2, 1, 1])
@@ -37,8 +33,8 @@ def plot_kpi_zone(df: pd.DataFrame):
         
         data = df_agg[df_agg['zone_type'] == zone_type]
         
-        # 绘制WNU
-        pivot_wnu = data.pivot_table(index='zone', columns='user_type', values='wnu', aggfunc='sum').fillna(0)
+        # 绘制WNU (WNU与WSALES一次透视)
+        pivot_wnu = pivot(data, 'zone', 'user_type', 'wnu', values=['wnu', 'wsales'])
         pivot_wnu.plot.bar(stacked=True, ax=ax_wnu, color=config.DEFAULT_COLORS, legend=False)
         ax_wnu.set_title(zone_titles[zone_type], loc='left', fontsize=10)
         ax_wnu.set_xlabel('')
@@ -47,7 +43,7 @@ def plot_kpi_zone(df: pd.DataFrame):
             ax_wnu.legend(fontsize=7, loc='upper left')
 
         # 绘制WSALES
-        pivot_wsales = data.pivot_table(index='zone', columns='user_type', values='wsales', aggfunc='sum').fillna(0)
+        pivot_wsales = pivot(data, 'zone', 'user_type', 'wsales')
         pivot_wsales.plot.bar(stacked=True, ax=ax_wsales, color=config.DEFAULT_COLORS, legend=False)
         ax_wsales.set_xlabel('')
         if zone_type == 'xiaoqi':
@@ -56,10 +52,11 @@ def plot_kpi_zone(df: pd.DataFrame):
     fig.suptitle('WNU & Weekly Sales by Server Zone', x=0.03, y=.98, ha='left', fontsize=20)
     save_plot(fig, 'user_base_wnu_sales_by_zone.jpg', subdirectory='user_base')
 
-def plot_sales_index(df: pd.DataFrame):
-    """生成按档位划分的充值人数图表"""
-    df['date'] = pd.to_datetime(df.day, format='%Y%m%d')
-    df_recent = df[df['date'].isin(pd.date_range(df['date'].max() - pd.to_timedelta(60, unit="D"), df['date'].max()))].copy()
+def plot_sales_index(df: pd.DataFrame, periods=60):
+    """生成按档位划分的充值人数图表 (最近periods天)"""
+    df = timeindex.set_time_index(df, 'day')
+    df_recent = timeindex.last_days(df, periods).copy()
+    df_recent['date'] = df_recent.index
 
     fig, ax = plt.subplots(figsize=(14, 7), tight_layout=True)
     
@@ -86,14 +83,18 @@ def plot_sales_index(df: pd.DataFrame):
     save_plot(fig, 'user_base_paying_users_by_tier.jpg', subdirectory='user_base')
 
 
+# 图表注册表: 图表名 -> 数据源工作表、绘图函数及所需的日期窗口
+# range: 默认显示的最近天数, 可由 CHART_RANGES 或 --range 覆盖
+CHARTS = {
+    'zone': {'sheet': 'KPI_ZONE', 'usecols': range(7), 'plot': plot_kpi_zone,
+             'window': loader.RowWindow('day', 50, unit='days'), 'range': 50},
+    'sales_index': {'sheet': 'SALES_INDEX', 'usecols': range(4), 'plot': plot_sales_index,
+                    'window': loader.RowWindow('day', 60, unit='days'), 'range': 60},
+}
+
 def generate_all():
     """生成所有用户基础相关的图表"""
     print("\n--- Generating User Base Plots ---")
-    
-    df_zone = loader.load_sheet('KPI_ZONE', usecols=range(7))
-    if df_zone is not None:
-        plot_kpi_zone(df_zone)
-        
-    df_sales_index = loader.load_sheet('SALES_INDEX', usecols=range(4))
-    if df_sales_index is not None:
-        plot_sales_index(df_sales_index)
+    # runner imports the report modules, so import it only when called
+    from ..core import runner
+    runner.generate_module('user_base')
@@ -0,0 +1,86 @@
+# downsample.py
+import numpy as np
+import pandas as pd
+from .. import config
+
+
+def _as_numbers(x) -> np.ndarray:
+    """Positions of `x` on a numeric axis: dates as nanoseconds, numbers as is, anything else by rank."""
+    values = np.asarray(x)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype('datetime64[ns]').astype('int64').astype(float)
+    if np.issubdtype(values.dtype, np.number):
+        return values.astype(float)
+    return np.arange(len(values), dtype=float)
+
+
+def lttb(x, y, max_points: int) -> np.ndarray:
+    """
+    Indices of the points Largest-Triangle-Three-Buckets keeps of a line.
+
+    The first and last points are always kept. The points in between are
+    split into max_points - 2 buckets of consecutive points, and each bucket
+    keeps the point forming the largest triangle with the point kept from
+    the previous bucket and the average of the next bucket, so peaks, dips
+    and the overall shape survive.
+
+    Args:
+        x: x values (numbers or dates), in ascending order.
+        y: y values. Points where y is NaN are dropped when downsampling.
+        max_points: Number of points to keep (at least 3).
+
+    Returns:
+        Sorted integer indices into x and y; every index if the line has
+        no more than max_points points.
+    """
+    n = len(y)
+    if n <= max_points or max_points < 3:
+        return np.arange(n)
+    x = _as_numbers(x)
+    y = np.asarray(y, dtype=float)
+    valid = np.isfinite(y)
+    if not valid.all():
+        positions = np.flatnonzero(valid)
+        return positions[lttb(x[valid], y[valid], max_points)]
+
+    # Bucket i spans edges[i]:edges[i + 1]; the last "bucket" is the final point
+    every = (n - 2) / (max_points - 2)
+    edges = np.append(np.floor(np.arange(max_points - 1) * every).astype(np.intp) + 1, n)
+    kept = np.empty(max_points, dtype=np.intp)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = edges[i + 1], edges[i + 2]
+        avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        # Twice the triangle areas; the constant factor does not change the argmax
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        kept[i + 1] = a
+    return kept
+
+
+def downsample(x, y, max_points=None):
+    """
+    A line's points reduced to at most `max_points` with lttb().
+
+    Args:
+        x: x values, in ascending order (array, list or pandas Series/Index).
+        y: y values of the same length.
+        max_points: Maximum number of points. Defaults to config.MAX_POINTS,
+            where None keeps every point.
+
+    Returns:
+        (x, y) with the kept points, of the same types as given.
+    """
+    max_points = config.MAX_POINTS if max_points is None else max_points
+    if max_points is None or len(y) <= max_points:
+        return x, y
+    kept = lttb(x, y, max_points)
+    return _take(x, kept), _take(y, kept)
+
+
+def _take(values, indices):
+    if isinstance(values, (pd.Series, pd.Index)):
+        return values[indices] if isinstance(values, pd.Index) else values.iloc[indices]
+    return np.asarray(values)[indices]
@@ -0,0 +1,104 @@
+# instrument.py
+import functools
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from ..core import context
+
+# Per thread: stages recorded since the last call to collect_stages() ('records')
+# and stages currently running, innermost last ('stack')
+_local = threading.local()
+
+
+def _state():
+    if not hasattr(_local, 'records'):
+        _local.records, _local.stack = [], []
+    return _local.records, _local.stack
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Record the wall time, CPU time and (optionally) peak memory of a block.
+
+    Stages nest: a stage started inside another is recorded under a
+    '/'-joined path such as 'build/process'. Every thread records its own
+    stages, and their CPU time is that of the recording thread only. Peak memory is only traced when the run's TRACE_MEMORY setting
+    is on, as tracemalloc slows everything down; it is traced process-wide,
+    so with several threads busy a peak includes the others' allocations.
+
+    Args:
+        name: Stage name, e.g. 'load', 'process', 'layout' or 'save'.
+    """
+    _records, _stack = _state()
+    trace = context.current().trace_memory
+    if trace:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # Hand the peak reached so far to the enclosing stage before resetting it
+        current, peak = tracemalloc.get_traced_memory()
+        if _stack:
+            _stack[-1]['peak'] = max(_stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+    frame = {'path': '/'.join([f['name'] for f in _stack] + [name]), 'name': name,
+             'base': current if trace else 0, 'peak': 0, 'child_wall': 0.0, 'child_cpu': 0.0}
+    _stack.append(frame)
+    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        wall, cpu = time.perf_counter() - wall_start, time.thread_time() - cpu_start
+        _stack.pop()
+        # self_* exclude the time of nested stages
+        record = {'stage': frame['path'], 'wall': wall, 'cpu': cpu,
+                  'self_wall': wall - frame['child_wall'], 'self_cpu': cpu - frame['child_cpu'], 'peak_mb': None}
+        if _stack:
+            _stack[-1]['child_wall'] += wall
+            _stack[-1]['child_cpu'] += cpu
+        if trace and tracemalloc.is_tracing():
+            frame['peak'] = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            record['peak_mb'] = (frame['peak'] - frame['base']) / 1024 ** 2
+            if _stack:
+                _stack[-1]['peak'] = max(_stack[-1]['peak'], frame['peak'])
+            tracemalloc.reset_peak()
+        _records.append(record)
+
+
+def timed(name: str):
+    """Decorator form of stage()."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def collect_stages() -> list:
+    """Return the stages this thread recorded since its previous call and reset the list."""
+    _records = _state()[0]
+    records = list(_records)
+    _records.clear()
+    return records
+
+
+def summarize(records) -> dict:
+    """
+    Per-stage totals of one chart.
+
+    Time of a stage is counted exclusively: the 'build' stage of a plot
+    function does not include the processing, layout and save stages that
+    ran inside it. Peak memory is the largest peak of the stage's records.
+    """
+    summary = {}
+    for record in records:
+        entry = summary.setdefault(record['stage'].rsplit('/', 1)[-1],
+                                   {'wall': 0.0, 'cpu': 0.0, 'peak_mb': None, 'calls': 0})
+        entry['wall'] += record['self_wall']
+        entry['cpu'] += record['self_cpu']
+        entry['calls'] += 1
+        if record['peak_mb'] is not None:
+            entry['peak_mb'] = max(entry['peak_mb'] or 0.0, record['peak_mb'])
+    return summary
@@ -1,41 +1,288 @@
 # plot_utils.py
-import matplotlib.pyplot as plt
+import io
+import os
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import matplotlib
+import matplotlib.colors as mcolors
 import pandas as pd
 import numpy as np
+from PIL import Image
+from matplotlib.collections import PathCollection
+from matplotlib.font_manager import FontProperties
+from matplotlib.path import Path
+from matplotlib.textpath import TextPath
+from matplotlib.transforms import Affine2D
 from .. import config
+from ..core import context
+from . import instrument
+
+# Paths written by save_plot since the last call to collect_saved_paths()
+_saved_paths = []
+# Images queued for the background writers: (path, future)
+_pending = []
+_writer = None
+_pivot_cache = None
+
+# Output format -> Pillow format name (SVG is written by matplotlib itself)
+PIL_FORMATS = {'jpg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP'}
 
 def setup_matplotlib_style():
     """Apply custom matplotlib styles"""
     style = config.get_plot_style()
-    plt.rcParams.update(style)
+    matplotlib.rcParams.update(style)
     print("Matplotlib style updated.")
 
+def _get_writer() -> ThreadPoolExecutor:
+    global _writer
+    if _writer is None:
+        _writer = ThreadPoolExecutor(max_workers=config.OUTPUT_WRITERS, thread_name_prefix='plot-writer')
+    return _writer
+
+def _reset_after_fork():
+    """A forked child has none of its parent's writer threads: start over with a new pool and queue."""
+    global _writer
+    _writer = None
+    _pending.clear()
+    _saved_paths.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _rasterise(fig, dpi):
+    """Render the figure, cropped like bbox_inches='tight', to raw RGBA bytes and its pixel size."""
+    sizes = []
+    cid = fig.canvas.mpl_connect('draw_event', lambda event: sizes.append(
+        (int(event.renderer.width), int(event.renderer.height))))
+    try:
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='rgba', dpi=dpi, bbox_inches='tight')
+    finally:
+        fig.canvas.mpl_disconnect(cid)
+    # The last draw is the final, cropped one
+    rgba = buffer.getvalue()
+    width, height = sizes[-1]
+    if width * height * 4 != len(rgba):
+        raise ValueError(f'Unexpected raster size {width}x{height} for {len(rgba)} bytes')
+    return rgba, (width, height)
+
+def _encode(full_path, fmt, rgba, size, dpi, quality, facecolor):
+    """Encode and write one image (runs on a writer thread)."""
+    start_time = time.perf_counter()
+    image = Image.frombuffer('RGBA', size, rgba, 'raw', 'RGBA', 0, 1)
+    params = {'dpi': (dpi, dpi)}
+    if fmt == 'jpg':
+        # JPEG has no alpha: composite onto the figure background like matplotlib does
+        background = Image.new('RGB', size, tuple(int(c * 255) for c in mcolors.to_rgb(facecolor)))
+        background.paste(image, mask=image)
+        image = background
+    if quality is not None and fmt in ('jpg', 'webp'):
+        params['quality'] = quality
+    image.save(full_path, format=PIL_FORMATS[fmt], **params)
+    return time.perf_counter() - start_time
+
+def _write_bytes(full_path, data):
+    start_time = time.perf_counter()
+    full_path.write_bytes(data)
+    return time.perf_counter() - start_time
+
 def save_plot(fig, filename, subdirectory=None):
     """
     Save the chart to the output directory.
+
+    The figure is drawn on the calling thread; encoding and writing the
+    image file happen on a background writer thread, so the next chart can
+    be drawn meanwhile. Call flush_outputs() to wait for the files.
+    The output directory, format, DPI and quality come from the active run
+    context (see core.context); the file suffix follows the format.
     
     Args:
         fig: matplotlib figure object.
         filename: Output filename.
         subdirectory: Optional subdirectory within the output directory.
+
+    Raises:
+        Exception: Errors drawing or rasterising the figure, after it is closed.
     """
-    output_path = config.OUTPUT_DIR
+    run = context.current()
+    output_path = run.output_dir
     if subdirectory:
         output_path = output_path / subdirectory
-        output_path.mkdir(parents=True, exist_ok=True)
+    output_path.mkdir(parents=True, exist_ok=True)
         
-    full_path = output_path / filename
+    full_path = (output_path / filename).with_suffix(f'.{run.output_format}')
     try:
-        fig.savefig(full_path, bbox_inches='tight')
-        print(f"Plot saved to {full_path}")
+        with instrument.stage('layout'):
+            _run_layout(fig)
+        with instrument.stage('save'):
+            _queue_image(fig, full_path, run)
     except Exception as e:
+        # Raised to the runner, which marks the chart failed so the manifest does not record it
         print(f"Error saving plot {full_path}: {e}")
-    plt.close(fig)
+        raise
+    finally:
+        # Figures come from pyplot, which the calling module has already imported
+        import matplotlib.pyplot as plt
+        plt.close(fig)
+
+def _run_layout(fig):
+    """Run the figure's layout engine once, so saving does not run it again."""
+    engine = fig.get_layout_engine()
+    if engine is not None:
+        engine.execute(fig)
+        fig.set_layout_engine('none')
+
+def _wait_for_writers():
+    """Block while OUTPUT_QUEUE images are waiting for a writer; the wait is timed as 'write_wait'."""
+    queued = [future for _, future in _pending if not future.done()]
+    if len(queued) < config.OUTPUT_QUEUE:
+        return
+    with instrument.stage('write_wait'):
+        while len(queued) >= config.OUTPUT_QUEUE:
+            wait(queued, return_when=FIRST_COMPLETED)
+            queued = [future for future in queued if not future.done()]
+
+def _queue_image(fig, full_path, run):
+    """Draw the figure and queue the image for a writer thread."""
+    _wait_for_writers()
+    fmt = run.output_format
+    if fmt == 'svg':
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='svg', bbox_inches='tight')
+        future = _get_writer().submit(_write_bytes, full_path, buffer.getvalue())
+    else:
+        dpi = run.output_dpi or fig.dpi
+        rgba, size = _rasterise(fig, dpi)
+        future = _get_writer().submit(_encode, full_path, fmt, rgba, size, dpi,
+                                      run.output_quality, fig.get_facecolor())
+    _pending.append((full_path, future))
+    _saved_paths.append(full_path)
+
+def flush_outputs() -> list:
+    """
+    Wait until every queued image is written.
+
+    Returns:
+        One record per image: path, size in bytes, encode seconds and the
+        error message if writing failed.
+    """
+    records = []
+    while _pending:
+        full_path, future = _pending.pop(0)
+        record = {'path': str(full_path), 'bytes': 0, 'seconds': 0.0, 'error': None}
+        try:
+            record['seconds'] = future.result()
+            record['bytes'] = full_path.stat().st_size
+            print(f"Plot saved to {full_path} ({record['bytes'] / 1024:.0f} KB, {record['seconds'] * 1000:.0f} ms)")
+        except Exception as e:
+            record['error'] = f'{type(e).__name__}: {e}'
+            print(f"Error saving plot {full_path}: {e}")
+        records.append(record)
+    return records
+
+def collect_saved_paths():
+    """Return the paths saved since the previous call and reset the list."""
+    paths = list(_saved_paths)
+    _saved_paths.clear()
+    return paths
+
+def _pivot_values(df, index, columns, values, aggfunc):
+    """Pivot several values in one pass; each table as pivot_table(values=value).fillna(0) returns it."""
+    table = df.pivot_table(index=index, columns=columns, values=list(values), aggfunc=aggfunc, observed=True)
+    # pivot_table drops rows and columns that are all NaN across every value
+    # pivoted together; a single-value pivot drops them per value
+    return {value: table[value].dropna(how='all').dropna(axis=1, how='all').fillna(0) for value in values}
+
+class PivotCache:
+    """
+    Bounded cache of the pivot tables drawn by the plotting helpers.
+
+    Charts often plot several values of one frame against the same index and
+    columns (e.g. WAU and WNU by source). The first request pivots every
+    value the caller names in a single pass; the other values are then
+    served from the cache. Entries are keyed by the frame's identity and
+    shape and the pivot parameters. They are dropped when the frame is
+    garbage collected, and the least recently used are evicted beyond
+    `max_entries`. Frames must not be modified once pivoted, and the
+    returned tables are shared, so callers must not modify them either.
+
+    Args:
+        max_entries: Pivot tables kept (one per value). Defaults to config.PIVOT_CACHE_SIZE.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or config.PIVOT_CACHE_SIZE
+        self.hits = 0
+        self.misses = 0
+        self._tables = OrderedDict()  # key -> pivot table of one value
+        self._frames = {}  # id(frame) -> weak reference forgetting the frame's tables
+
+    def __len__(self):
+        return len(self._tables)
+
+    def pivot(self, df, index, columns, value, values=None, aggfunc='sum'):
+        """
+        Pivot table of one value of `df`, summed (by default) over index x columns.
+
+        Args:
+            df: Pandas DataFrame containing the data.
+            index: Column whose values become the rows.
+            columns: Column whose values become the columns.
+            value: Column to aggregate.
+            values: Other columns that will be requested from the same frame,
+                index and columns; they are pivoted in the same pass.
+            aggfunc: Aggregation passed to pivot_table.
+
+        Returns:
+            The pivot table, with missing cells filled with 0.
+        """
+        key = (id(df), df.shape, index, columns, aggfunc)
+        table = self._tables.get(key + (value,))
+        if table is not None:
+            self.hits += 1
+            self._tables.move_to_end(key + (value,))
+            return table
+
+        self.misses += 1
+        wanted = [value] + [other for other in dict.fromkeys(values or ())
+                            if other != value and key + (other,) not in self._tables]
+        tables = _pivot_values(df, index, columns, wanted, aggfunc)
+        if id(df) not in self._frames:
+            self._frames[id(df)] = weakref.ref(df, lambda ref, frame_id=id(df): self._forget(frame_id))
+        for name, pivoted in tables.items():
+            self._tables[key + (name,)] = pivoted
+        while len(self._tables) > self.max_entries:
+            self._tables.popitem(last=False)
+        return tables[value]
+
+    def _forget(self, frame_id):
+        """Drop the tables of a frame that has been garbage collected."""
+        self._frames.pop(frame_id, None)
+        for key in [key for key in self._tables if key[0] == frame_id]:
+            del self._tables[key]
+
+    def clear(self):
+        self._tables.clear()
+        self._frames.clear()
+
+def pivot(df, index, columns, value, values=None, aggfunc='sum'):
+    """
+    Pivot table of one value of `df` from the shared PivotCache.
+
+    See PivotCache.pivot for the arguments. Pass every value that will be
+    plotted from the same frame as `values`, so they are pivoted together.
+    """
+    global _pivot_cache
+    if _pivot_cache is None:
+        _pivot_cache = PivotCache()
+    return _pivot_cache.pivot(df, index, columns, value, values=values, aggfunc=aggfunc)
 
 def plot_stacked_bar(df, ax, x_col, y_col, category_col, title,
                      xlabel='', ylabel='',
                      xtick_rotation=0, legend_loc='best',
-                     colors=None):
+                     colors=None, values=None):
     """
     Create a clean stacked bar chart using pivot_table.
 
@@ -46,9 +293,11 @@ def plot_stacked_bar(df, ax, x_col, y_col, category_col, title,
         y_col: Column name for the y-axis (values).
         category_col: Column name for stacking categories.
         title: Chart title.
+        values: Every y column plotted from `df` by x_col and category_col;
+            the first chart pivots them all at once (see pivot()).
     """
     colors = colors or config.DEFAULT_COLORS
-    pivot_df = df.pivot_table(index=x_col, columns=category_col, values=y_col, aggfunc='sum').fillna(0)
+    pivot_df = pivot(df, x_col, category_col, y_col, values=values)
     
     # Sort categories if a specific order is needed
     if category_col == 'regmonth2': # Example of specific ordering
@@ -64,3 +313,120 @@ def plot_stacked_bar(df, ax, x_col, y_col, category_col, title,
     ax.tick_params(axis='x', rotation=xtick_rotation)
     ax.grid(False)
     ax.legend(loc=legend_loc, fontsize=8)
+
+def plot_heatmap(df, ax, index, columns, value, title, values=None, aggfunc='mean', fmt='g', cmap=None):
+    """
+    Draw an annotated heatmap of one value pivoted by index x columns.
+
+    Args:
+        df: Pandas DataFrame containing the data.
+        ax: Matplotlib axes object.
+        index: Column whose values become the rows.
+        columns: Column whose values become the columns.
+        value: Column to show.
+        title: Chart title.
+        values: Every value drawn from `df` by index and columns; the first
+            heatmap pivots them all at once (see pivot()).
+        aggfunc: Aggregation passed to pivot_table.
+        fmt: Format of the cell annotations.
+        cmap: Matplotlib colormap.
+
+    Returns:
+        The pivot table drawn, e.g. to label its rows.
+    """
+    # seaborn is slow to import; load it only when a heatmap is drawn
+    import seaborn as sns
+    pivot_df = pivot(df, index, columns, value, values=values, aggfunc=aggfunc)
+    sns.heatmap(pivot_df, ax=ax, annot=True, fmt=fmt, cmap=cmap)
+    ax.set_title(title, loc='left')
+    return pivot_df
+
+class _ValueLabels(PathCollection):
+    """Text labels drawn as one collection of glyph outlines, optionally thinned."""
+
+    def __init__(self, paths, widths, thin, **kwargs):
+        super().__init__(paths, **kwargs)
+        self._all_paths = list(paths)
+        self._all_offsets = np.asarray(self.get_offsets())
+        self._widths = np.asarray(widths)
+        self._thin = thin
+
+    def draw(self, renderer):
+        if self._thin and len(self._all_paths):
+            keep = self._non_overlapping(renderer)
+            self.set_paths([path for path, kept in zip(self._all_paths, keep) if kept])
+            self.set_offsets(self._all_offsets[keep])
+        super().draw(renderer)
+
+    def _non_overlapping(self, renderer):
+        """Greedily keep labels, left to right, that do not overlap the previous kept one."""
+        x = self.get_offset_transform().transform(self._all_offsets)[:, 0]
+        half = self._widths * renderer.points_to_pixels(1.0) / 2
+        keep = np.zeros(len(x), dtype=bool)
+        right = -np.inf
+        for i in np.argsort(x, kind='stable'):
+            if x[i] - half[i] >= right:
+                keep[i] = True
+                right = x[i] + half[i]
+        return keep
+
+
+def add_value_labels(ax, x, y, labels=None, offset=0, fontsize=10, color=None,
+                     ha='center', va='bottom', thin=False):
+    """
+    Label data points with their values, drawn as a single artist.
+
+    Unlike one `ax.text` per point, the labels are rendered as glyph outlines
+    in one collection, so layout and saving do not have to measure every
+    label and their cost stays flat as the number of points grows.
+
+    Args:
+        ax: Matplotlib axes object.
+        x: x positions (numeric, dates or categories already plotted on `ax`).
+        y: y positions in data units.
+        labels: Label strings. Defaults to the y values. Points with an empty label are not labelled.
+        offset: Vertical offset of the labels in data units.
+        fontsize: Font size in points.
+        color: Label color. Defaults to the text color of the style.
+        ha, va: Alignment of each label relative to its point.
+        thin: Drop labels that would overlap a label to their left.
+
+    Returns:
+        The label collection.
+    """
+    y = np.asarray(y)
+    if labels is None:
+        labels = [str(value) for value in y]
+    x = np.asarray(ax.xaxis.convert_units(np.asarray(x)), dtype=float)
+    y = np.asarray(ax.yaxis.convert_units(y), dtype=float) + offset
+    # Empty labels have no glyphs to draw (TextPath cannot build them)
+    labels = list(labels)
+    drawn = np.array([label != '' for label in labels], dtype=bool)
+    if not drawn.all():
+        x, y = x[drawn], y[drawn]
+        labels = [label for label in labels if label != '']
+
+    prop = FontProperties(size=fontsize)
+    glyphs = {}
+    paths, widths = [], []
+    for label in labels:
+        if label not in glyphs:
+            path = TextPath((0, 0), label, prop=prop)
+            # Control-point bounds: much cheaper than exact Bezier extents
+            (x0, y0), (x1, y1) = path.vertices.min(axis=0), path.vertices.max(axis=0)
+            dx = {'left': -x0, 'center': -(x0 + x1) / 2, 'right': -x1}[ha]
+            dy = {'bottom': -y0, 'center': -(y0 + y1) / 2, 'top': -y1, 'baseline': 0}[va]
+            glyphs[label] = (Path(path.vertices + (dx, dy), path.codes), x1 - x0)
+        path, width = glyphs[label]
+        paths.append(path)
+        widths.append(width)
+
+    labels_artist = _ValueLabels(
+        paths, widths, thin,
+        offsets=np.column_stack([x, y]), offset_transform=ax.transData,
+        # Glyph outlines are in points
+        transform=Affine2D().scale(1 / 72) + ax.figure.dpi_scale_trans,
+        facecolors=color or matplotlib.rcParams['text.color'], edgecolors='none', linewidths=0,
+        zorder=3, clip_on=False)
+    ax.add_collection(labels_artist, autolim=False)
+    return labels_artist